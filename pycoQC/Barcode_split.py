@@ -92,7 +92,7 @@ def Barcode_split (
     bc_l = OrderedDict()
 
     logger.warning ("Split data per barcode")
-    for barcode, barcode_df in df.groupby("barcode"):
+    for barcode, barcode_df in df.groupby("barcode", observed=True):
         logger.info ("\tProcessing data for Barcode {}".format(barcode))
 
         # Skip unclassified if required
@@ -71,15 +71,48 @@ def main_pycoQC (args=None):
         help="Title to use in the html report (default: %(default)s)")
     parser_html.add_argument("--template_file", type=str, default="",
         help="Jinja2 html template for the html report (default: %(default)s)")
+    parser_html.add_argument("--report_fast_json", default=False, action='store_true',
+        help="If given, the figures of the html report are serialised with a NumPy aware JSON writer instead of plotly default encoder (default: %(default)s)")
+    parser_html.add_argument("--report_binary_arrays", default=False, action='store_true',
+        help=textwrap.dedent("""If given with --report_fast_json, large numeric arrays of the html report are embedded as base64 typed arrays
+        decoded in the browser, which makes the report smaller (default: %(default)s)"""))
+    parser_html.add_argument("--report_max_points", type=int, default=None,
+        help="If given, the 1D traces of the html report with more points are decimated to about n evenly spaced points (default: %(default)s)")
+    parser_html.add_argument("--report_float_precision", type=int, default=None,
+        help="If given, the float values of the html report traces are rounded to n significant digits (default: %(default)s)")
+    parser_html.add_argument("--report_trim_2d", default=False, action='store_true',
+        help="If given, the empty rows and columns at the edges of the 2D matrices of the html report are removed (default: %(default)s)")
+    parser_html.add_argument("--report_max_size", type=float, default=None,
+        help=textwrap.dedent("""If given, payload budget of the html report plots in MB. Larger reports are progressively reduced by trimming the
+        2D matrices, rounding the float values and decimating the 1D traces until they fit in the budget (default: %(default)s)"""))
     parser_html.add_argument("--config_file", type=str, default="",
         help=textwrap.dedent("""Path to a JSON configuration file for the html report.
             If not provided, looks for it in ~/.pycoQC and ~/.config/pycoQC/config. If it's still not found, falls back to default parameters.
             The first level keys are the names of the plots to be included.
             The second level keys are the parameters to pass to each plotting function (default: %(default)s)")"""))
     parser_other = parser.add_argument_group('Other options')
-    parser_other.add_argument("--sample", default=100000, type=int,
-        help=textwrap.dedent("""If not None a n number of reads will be randomly selected instead of the entire dataset for ploting function
-        (deterministic sampling) (default: %(default)s)"""))
+    parser_other.add_argument("--sample", default=None, type=int,
+        help="Deprecated and ignored. All the plots and statistics are computed from the full data (default: %(default)s)")
+    parser_other.add_argument("--quantile_error", default=None, type=float,
+        help=textwrap.dedent("""If given, percentiles and medians are estimated from mergeable quantile sketches with this approximative rank error.
+        By default they are computed exactly from the full data (default: %(default)s)"""))
+    parser_other.add_argument("--chunksize", default=0, type=int,
+        help=textwrap.dedent("""If given, the summary files are parsed by chunks of n lines and the read level filters are applied on the fly (streaming mode).
+        This reduces the memory usage for very large files (default: %(default)s)"""))
+    parser_other.add_argument("--compact_read_id", default=False, action='store_true',
+        help="If given in streaming mode, the read_id strings are replaced by compact 128 bits keys to further reduce the memory usage (default: %(default)s)")
+    parser_other.add_argument("--threads", "-t", default=1, type=int,
+        help="Number of worker processes to use to parse multiple input files and BAM regions in parallel, and to generate the plots of the html report (default: %(default)s)")
+    parser_other.add_argument("--bam_threads", default=1, type=int,
+        help="Number of htslib threads used to decompress each BAM file (default: %(default)s)")
+    parser_other.add_argument("--bam_sample", default=None, type=int,
+        help=textwrap.dedent("""If given, only about n primary alignments are parsed from randomly selected regions of the BAM files to estimate the
+        alignment metrics (deterministic sampling). The alignments counts are scaled to the total number of mapped reads in the BAM indexes (default: %(default)s)"""))
+    parser_other.add_argument("--cache_dir", default="", type=str,
+        help=textwrap.dedent("""If given, the parsed and cleaned data are saved in this directory and directly loaded from it in subsequent runs with the same
+        input files and parsing options (default: %(default)s)"""))
+    parser_other.add_argument("--cache_max_size", default=20, type=float,
+        help="Maximal size of the cache directory in GB. The least recently used entries are removed when the size is exceeded (default: %(default)s)")
     parser_other.add_argument("--default_config", "-d", action='store_true',
         help="Print default configuration file. Can be used to generate a template JSON file (default: %(default)s)")
     parser_verbosity = parser.add_mutually_exclusive_group()
@@ -120,11 +153,25 @@ def main_pycoQC (args=None):
         min_pass_qual = args.min_pass_qual,
         min_pass_len = args.min_pass_len,
         sample = args.sample,
+        quantile_error = args.quantile_error,
         html_outfile = args.html_outfile,
         report_title = args.report_title,
         config_file = args.config_file,
         template_file = args.template_file,
+        report_fast_json = args.report_fast_json,
+        report_binary_arrays = args.report_binary_arrays,
+        report_max_points = args.report_max_points,
+        report_float_precision = args.report_float_precision,
+        report_trim_2d = args.report_trim_2d,
+        report_max_size = args.report_max_size,
         json_outfile = args.json_outfile,
+        chunksize = args.chunksize,
+        compact_read_id = args.compact_read_id,
+        threads = args.threads,
+        bam_threads = args.bam_threads,
+        bam_sample = args.bam_sample,
+        cache_dir = args.cache_dir,
+        cache_max_size = args.cache_max_size,
         verbose = args.verbose,
         quiet = args.quiet)
 
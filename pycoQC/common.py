@@ -2,14 +2,21 @@
 
 # Standard library imports
 from os import access, R_OK, listdir, path, makedirs
+import os
 import inspect
+import json
+import shutil
 from glob import iglob, glob
 import sys
 import logging
 from collections import *
+from functools import partial, wraps
+import multiprocessing as mp
 
 # Third party imports
+import numpy as np
 import pandas as pd
+from pandas.api.types import is_integer_dtype, union_categoricals
 import pysam as ps
 
 #~~~~~~~~~~~~~~CUSTOM EXCEPTION AND WARN CLASSES~~~~~~~~~~~~~~#
@@ -132,6 +139,45 @@ def get_logger (name=None, verbose=False, quiet=False):
 
     return logger
 
+def memoize_data (func):
+    """
+    Decorator memoising a data preparation method on all its arguments, in a bounded LRU cache owned by the instance. The instance
+    has to define data_cache_size, an OrderedDict _data_cache and a Counter _data_cache_stats in which hits and misses are counted.
+    Cached values are returned as is and must not be modified by callers
+    """
+    sig = inspect.signature (func)
+
+    @wraps (func)
+    def wrapper (self, *args, **kwargs):
+        # Normalise positional, keyword and default arguments into a single key
+        bound = sig.bind (self, *args, **kwargs)
+        bound.apply_defaults ()
+        key = (func.__name__,) + tuple((k, v) for k, v in bound.arguments.items() if k != "self")
+        try:
+            hash (key)
+        except TypeError:
+            return func (self, *args, **kwargs)
+
+        # KeyError can only arise from a concurrent eviction when plots are generated in threads
+        try:
+            val = self._data_cache[key]
+            self._data_cache.move_to_end (key)
+            self._data_cache_stats["hits"] += 1
+            return val
+        except KeyError:
+            pass
+
+        self._data_cache_stats["misses"] += 1
+        val = func (self, *args, **kwargs)
+        self._data_cache[key] = val
+        try:
+            while len(self._data_cache) > self.data_cache_size:
+                self._data_cache.popitem (last=False)
+        except KeyError:
+            pass
+        return val
+    return wrapper
+
 def doc_func (func):
     """Parse the function description string"""
 
@@ -343,28 +389,638 @@ def expand_file_names(fn, bam_check=False):
                     raise pycoQCError("Bam file not sorted: {}. Please sort with samtools sort".format(f))
     return fn_list
 
-def merge_files_to_df(fn_list):
-    """"""
+def get_file_header (fn, sep="\t"):
+    """Return the list of column names found in the header line of a tabulated file (handle compressed files)"""
+    return list(pd.read_csv(fn, sep=sep, nrows=0).columns)
+
+def select_colnames (header, colnames_dict):
+    """
+    Match the field names found in a file header with the expected column names
+    Return a dict with the names found in the header as keys and the corresponding standard names as values
+    * header
+        List of field names found in the file header
+    * colnames_dict
+        Dict with standard column names as keys and list of accepted alias names as values, by order of preference
+    """
+    usecols_dict = OrderedDict()
+    for colname, alias_list in colnames_dict.items():
+        for alias in alias_list:
+            if alias in header:
+                usecols_dict[alias] = colname
+                break
+    return usecols_dict
+
+def merge_files_to_df(fn_list, colnames_dict=None, dtype_dict=None, threads=1):
+    """
+    Parse and concatenate a list of tabulated files in a single dataframe
+    * fn_list
+        List of paths to tabulated files to parse
+    * colnames_dict
+        Dict with standard column names as keys and list of accepted alias names as values, by order of preference.
+        If given, only the matching columns are parsed and renamed with the standard names. By default all columns are parsed.
+    * dtype_dict
+        Dict with standard column names as keys and dtypes as values. Values are directly parsed in the given dtype
+    * threads
+        Number of worker processes used to parse the files in parallel
+    """
     if len(fn_list) == 1:
-        df =  pd.read_csv(fn_list[0], sep ="\t")
+        df = read_file_to_df (fn_list[0], colnames_dict=colnames_dict, dtype_dict=dtype_dict)
 
     else:
-        df_list = []
-        for fn in fn_list:
-            df_list.append (pd.read_csv(fn, sep ="\t"))
-        df = pd.concat(df_list, ignore_index=True, sort=False, join="inner")
+        # Parse files to columnar arrays, in parallel worker processes if required
+        worker = partial (read_file_to_columns, colnames_dict=colnames_dict, dtype_dict=dtype_dict)
+        if threads > 1:
+            with mp.Pool (min(threads, len(fn_list))) as pool:
+                col_dict_list = pool.map (worker, fn_list)
+        else:
+            col_dict_list = [worker(fn) for fn in fn_list]
+
+        df = concat_columns_to_df (col_dict_list)
 
     if len(df) == 0:
         raise pycoQCError ("No valid read found in input file")
 
     return df
 
+def read_file_to_df (fn, colnames_dict=None, dtype_dict=None):
+    """
+    Parse a single tabulated file in a dataframe. See merge_files_to_df for options
+    """
+    # Simple case where all the columns are needed
+    if not colnames_dict:
+        return pd.read_csv(fn, sep ="\t")
+
+    # Find the columns to parse and their dtype from the header line
+    usecols_dict = select_colnames (get_file_header(fn), colnames_dict)
+    dtype_dict = dtype_dict if dtype_dict else {}
+    file_dtype_dict = {alias:dtype_dict[colname] for alias, colname in usecols_dict.items() if colname in dtype_dict}
+
+    try:
+        df = pd.read_csv(fn, sep ="\t", usecols=list(usecols_dict.keys()), dtype=file_dtype_dict)
+    # Integer fields cannot be parsed directly if they contain NA values. Fall back to default type for these fields
+    except ValueError:
+        file_dtype_dict = {alias:dtype for alias, dtype in file_dtype_dict.items() if not is_integer_dtype(dtype)}
+        df = pd.read_csv(fn, sep ="\t", usecols=list(usecols_dict.keys()), dtype=file_dtype_dict)
+
+    # Standardise col names and order
+    df = df.rename(columns=usecols_dict)
+    df = df[[c for c in colnames_dict.keys() if c in df]]
+    return df
+
+def iter_file_chunks (fn, chunksize, colnames_dict, dtype_dict=None):
+    """
+    Parse a tabulated file by chunks of lines and yield a dataframe per chunk. See merge_files_to_df for options.
+    Integer fields are not cast at parsing time since they might contain NA values.
+    """
+    usecols_dict = select_colnames (get_file_header(fn), colnames_dict)
+    dtype_dict = dtype_dict if dtype_dict else {}
+    file_dtype_dict = {alias:dtype_dict[colname] for alias, colname in usecols_dict.items() if colname in dtype_dict and not is_integer_dtype(dtype_dict[colname])}
+
+    for df in pd.read_csv(fn, sep ="\t", usecols=list(usecols_dict.keys()), dtype=file_dtype_dict, chunksize=chunksize):
+        df = df.rename(columns=usecols_dict)
+        yield df[[c for c in colnames_dict.keys() if c in df]]
+
+def read_file_to_columns (fn, colnames_dict=None, dtype_dict=None):
+    """
+    Parse a single tabulated file in a dict of compact column arrays (numpy arrays or pandas Categorical).
+    See merge_files_to_df for options
+    """
+    df = read_file_to_df (fn, colnames_dict=colnames_dict, dtype_dict=dtype_dict)
+    col_dict = OrderedDict()
+    for col in df.columns:
+        col_dict[col] = df[col].values
+    return col_dict
+
+def concat_columns_to_df (col_dict_list):
+    """
+    Concatenate a list of dict of column arrays in a single dataframe. All the columns found in any of the dicts are retained and
+    the values missing from the other dicts are filled with NA values (NaN for numeric columns). Each column is concatenated once.
+    Categorical columns are kept categorical with the union of all categories
+    """
+    # Ordered union of the column names
+    colnames = []
+    for d in col_dict_list:
+        colnames.extend (col for col in d if not col in colnames)
+
+    col_dict = OrderedDict()
+    for col in colnames:
+        ref = next (d[col] for d in col_dict_list if col in d)
+        col_list = [d[col] if col in d else na_array(ref, len(next(iter(d.values())))) for d in col_dict_list]
+        if isinstance(ref, pd.Categorical):
+            col_dict[col] = union_categoricals (col_list, sort_categories=True)
+        else:
+            col_dict[col] = np.concatenate (col_list)
+    return pd.DataFrame (col_dict)
+
+def na_array (ref, n):
+    """
+    Return an array of n NA values compatible with a reference array: an empty categorical for categorical arrays, NaN for
+    numeric arrays and None for other arrays
+    """
+    if isinstance(ref, pd.Categorical):
+        return pd.Categorical.from_codes (np.full(n, -1, dtype=np.int8), categories=ref.categories[:0])
+    elif ref.dtype.kind in "iuf":
+        return np.full (n, np.nan, dtype=np.result_type(ref.dtype, np.float32))
+    else:
+        return np.full (n, None, dtype=object)
+
+def duplicated_str_array (a):
+    """
+    Return a boolean mask flagging all but the first occurrence of each value in an array of strings.
+    Values are compared through compact 64 bits hashes and only the values with colliding hashes are compared directly
+    """
+    h = pd.util.hash_array (np.asarray(a, dtype=object))
+    candidates = pd.Series(h).duplicated(keep=False).values
+    duplicated = np.zeros (len(h), dtype=bool)
+    if candidates.any():
+        duplicated[candidates] = pd.Series(np.asarray(a, dtype=object)[candidates]).duplicated(keep="first").values
+    return duplicated
+
+class Hist1D ():
+    """
+    Mergeable streaming 1D histogram with fixed bins. Values can be accumulated by chunks and the memory usage only depends on the
+    number of bins
+    * bins
+        Array of bin edges
+    """
+    def __init__ (self, bins):
+        self.bins = np.asarray (bins)
+        self.counts = np.zeros (len(self.bins)-1, dtype=np.int64)
+
+    @classmethod
+    def from_range (cls, min, max, nbins, scale="linear"):
+        """Create a histogram of nbins edges spanning the range min to max in linear or log space"""
+        if scale == "log":
+            bins = np.logspace (np.log10(min), np.log10(max)+0.1, nbins)
+        else:
+            bins = np.linspace (min, max, nbins)
+        return cls (bins)
+
+    def update (self, values):
+        """Add an array of values to the histogram. NA values are ignored"""
+        values = np.asarray (values)
+        values = values[~np.isnan(values)]
+        self.counts += np.histogram (values, bins=self.bins)[0]
+
+    def merge (self, other):
+        """Merge another histogram with the same bins"""
+        if not np.array_equal (self.bins, other.bins):
+            raise pycoQCError ("Cannot merge histograms with different bins")
+        self.counts += other.counts
+
+class Hist2D ():
+    """
+    Mergeable streaming 2D histogram with fixed bins. Values can be accumulated by chunks and the memory usage only depends on the
+    number of bins. counts[i,j] is the number of values in the ith x bin and jth y bin
+    * x_bins
+        Array of bin edges for x values
+    * y_bins
+        Array of bin edges for y values
+    """
+    def __init__ (self, x_bins, y_bins):
+        self.x_bins = np.asarray (x_bins)
+        self.y_bins = np.asarray (y_bins)
+        self.counts = np.zeros ((len(self.x_bins)-1, len(self.y_bins)-1), dtype=np.int64)
+
+    def update (self, x_values, y_values):
+        """Add arrays of paired x and y values to the histogram. Pairs containing NA values are ignored"""
+        x_values = np.asarray (x_values)
+        y_values = np.asarray (y_values)
+        valid = ~(np.isnan(x_values) | np.isnan(y_values))
+        self.counts += np.histogram2d (x=x_values[valid], y=y_values[valid], bins=[self.x_bins, self.y_bins])[0].astype(np.int64)
+
+    def merge (self, other):
+        """Merge another histogram with the same bins"""
+        if not (np.array_equal (self.x_bins, other.x_bins) and np.array_equal (self.y_bins, other.y_bins)):
+            raise pycoQCError ("Cannot merge histograms with different bins")
+        self.counts += other.counts
+
+class MetricCube ():
+    """
+    Sparse pre-aggregated cube of reads and bases counts over integer coded dimensions. Only the non-empty cells are stored, as the
+    linear index of each cell in the dense cube and its counts. Chunks of reads are aggregated independently and merged, so the memory
+    usage only depends on the number of distinct cells
+    * dim_names
+        List of dimension names
+    * shape
+        List of the number of codes of each dimension. Codes of a dimension range from 0 to its size-1
+    """
+    def __init__ (self, dim_names, shape):
+        self.dim_names = list(dim_names)
+        self.shape = tuple(int(i) for i in shape)
+        self.cell_idx = np.zeros (0, dtype=np.int64)
+        self.reads = np.zeros (0, dtype=np.int64)
+        self.bases = np.zeros (0, dtype=np.int64)
+
+    def __len__ (self):
+        return len(self.cell_idx)
+
+    def update (self, dim_dict, read_len):
+        """
+        Aggregate a chunk of reads
+        * dim_dict
+            Dictionary of integer codes array per dimension name
+        * read_len
+            Array of read length
+        """
+        cell_idx = np.ravel_multi_index ([np.asarray(dim_dict[dim], dtype=np.int64) for dim in self.dim_names], self.shape)
+        self._add (cell_idx, np.ones(len(cell_idx), dtype=np.int64), np.asarray(read_len, dtype=np.int64))
+
+    def merge (self, other):
+        """Merge another cube with the same dimensions"""
+        if self.dim_names != other.dim_names or self.shape != other.shape:
+            raise pycoQCError ("Cannot merge cubes with different dimensions")
+        self._add (other.cell_idx, other.reads, other.bases)
+
+    def reduce (self, dims, **filters):
+        """
+        Sum the reads and bases counts over all the dimensions not listed in dims, for the cells matching all the filters. Return a
+        dict with the codes of the non-empty cells for each dimension in dims and their reads and bases counts, sorted by codes.
+        Without dims, return a dict of total counts
+        * dims
+            List of dimensions to keep
+        * filters
+            Code required for a dimension, for example run_id=0
+        """
+        codes = np.unravel_index (self.cell_idx, self.shape)
+        code_dict = OrderedDict (zip (self.dim_names, codes))
+        mask = np.ones (len(self.cell_idx), dtype=bool)
+        for dim, val in filters.items():
+            mask &= code_dict[dim] == val
+        if not dims:
+            return {"reads":int(self.reads[mask].sum()), "bases":int(self.bases[mask].sum())}
+
+        sub_shape = [self.shape[self.dim_names.index(dim)] for dim in dims]
+        sub_idx, inv = np.unique (np.ravel_multi_index ([code_dict[dim][mask] for dim in dims], sub_shape), return_inverse=True)
+        d = OrderedDict (zip (dims, np.unravel_index (sub_idx, sub_shape)))
+        d["reads"] = np.bincount (inv, weights=self.reads[mask], minlength=len(sub_idx)).astype(np.int64)
+        d["bases"] = np.bincount (inv, weights=self.bases[mask], minlength=len(sub_idx)).astype(np.int64)
+        return d
+
+    def _add (self, cell_idx, reads, bases):
+        cell_idx, inv = np.unique (np.concatenate((self.cell_idx, cell_idx)), return_inverse=True)
+        self.reads = np.bincount (inv, weights=np.concatenate((self.reads, reads)), minlength=len(cell_idx)).astype(np.int64)
+        self.bases = np.bincount (inv, weights=np.concatenate((self.bases, bases)), minlength=len(cell_idx)).astype(np.int64)
+        self.cell_idx = cell_idx
+
+class QuantileSketch ():
+    """
+    Mergeable streaming quantile sketch (KLL). Values are kept in a hierarchy of compactors in which each retained value stands for
+    2**level original values. When a compactor exceeds its capacity, its values are sorted and every other value is promoted to the
+    next level. The rank error of the estimated quantiles is about eps, for a memory usage in O(1/eps) values. Min and max are exact
+    * eps
+        Approximative rank error bound, as a fraction of the number of values
+    * seed
+        Seed of the random compaction offsets generator
+    """
+    def __init__ (self, eps=0.01, seed=42):
+        self.eps = eps
+        self.k = max (int(np.ceil(2/eps)), 8)
+        self.rng = np.random.RandomState (seed=seed)
+        self.count = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.compactors = [np.array([], dtype=np.float64)]
+
+    def __len__ (self):
+        return self.count
+
+    def update (self, values):
+        """Add an array of values to the sketch. NA values are ignored"""
+        values = np.asarray (values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = np.nanmin ([self.min, values.min()])
+        self.max = np.nanmax ([self.max, values.max()])
+        self.compactors[0] = np.concatenate ([self.compactors[0], values])
+        self._compress ()
+
+    def merge (self, other):
+        """Merge another sketch"""
+        if not other.count:
+            return
+        self.count += other.count
+        self.min = np.nanmin ([self.min, other.min])
+        self.max = np.nanmax ([self.max, other.max])
+        for level, values in enumerate (other.compactors):
+            if level == len(self.compactors):
+                self.compactors.append (np.array([], dtype=np.float64))
+            self.compactors[level] = np.concatenate ([self.compactors[level], values])
+        self._compress ()
+
+    def quantile (self, q):
+        """Estimate the quantiles q (scalar or array of values between 0 and 1)"""
+        if not self.count:
+            return np.full (np.shape(q), np.nan) if np.ndim(q) else np.nan
+        values = np.concatenate (self.compactors)
+        weights = np.concatenate ([np.full(len(c), 2**level, dtype=np.float64) for level, c in enumerate(self.compactors)])
+        order = np.argsort (values, kind="mergesort")
+        values = values[order]
+        cum_weights = np.cumsum (weights[order])
+
+        # Rank of each quantile among the weighted values. Extreme quantiles are exact
+        q = np.asarray (q, dtype=np.float64)
+        idx = np.clip (np.searchsorted (cum_weights, q*cum_weights[-1], side="left"), 0, len(values)-1)
+        res = values[idx]
+        res = np.where (q<=0, self.min, np.where (q>=1, self.max, res))
+        return res if res.ndim else float(res)
+
+    def _capacity (self, level):
+        """Capacity of a compactor, decreasing geometrically with the depth below the top level"""
+        return max (int(np.ceil(self.k*(2/3)**(len(self.compactors)-level-1))), 2)
+
+    def _compress (self):
+        level = 0
+        while level < len(self.compactors):
+            if len(self.compactors[level]) > self._capacity(level):
+                if level+1 == len(self.compactors):
+                    self.compactors.append (np.array([], dtype=np.float64))
+                values = np.sort (self.compactors[level])
+                # Keep the last value at the current level if the number of values is odd
+                if len(values)%2:
+                    values, kept = values[:-1], values[-1:]
+                else:
+                    kept = values[:0]
+                offset = self.rng.randint(2)
+                self.compactors[level+1] = np.concatenate ([self.compactors[level+1], values[offset::2]])
+                self.compactors[level] = kept
+            level += 1
+
+def grouped_quantiles (group_idx, values, n_groups, q):
+    """
+    Compute quantiles of values for all groups at once, with the same linear interpolation as np.percentile. Values are sorted once
+    by (group, value) and the quantiles of every group are then gathered by array indexing. Returns an array of shape (n_groups, len(q))
+    in which groups without values are filled with NA
+    * group_idx
+        Array of group index of each value, between 0 and n_groups-1
+    * values
+        Array of values. NA values are ignored
+    * n_groups
+        Number of groups
+    * q
+        Quantiles to compute, between 0 and 1
+    """
+    group_idx = np.asarray (group_idx)
+    values = np.asarray (values, dtype=np.float64)
+    q = np.asarray (q, dtype=np.float64)
+    valid = ~np.isnan (values)
+    group_idx = group_idx[valid]
+    values = values[valid]
+
+    # Sort by group then by value and find the start of each group
+    order = np.lexsort ((values, group_idx))
+    values = values[order]
+    counts = np.bincount (group_idx, minlength=n_groups)
+    starts = np.cumsum (counts) - counts
+
+    # Interpolate between the 2 closest ranks of each group
+    pos = (np.maximum (counts, 1)-1)[:,None] * q[None,:]
+    lo = np.floor (pos).astype (np.int64)
+    hi = np.minimum (lo+1, np.maximum (counts, 1)[:,None]-1)
+    frac = pos-lo
+    res = np.full ((n_groups, len(q)), np.nan)
+    nonempty = counts > 0
+    if nonempty.any():
+        lo_val = values[(starts[:,None]+lo)[nonempty]]
+        hi_val = values[(starts[:,None]+hi)[nonempty]]
+        res[nonempty] = lo_val + (hi_val-lo_val)*frac[nonempty]
+    return res
+
+# Lookup table of lowercase hexadecimal digits values (255 for other characters)
+HEX_VALUES = np.full (256, 255, dtype=np.uint8)
+for i, c in enumerate ("0123456789abcdef"):
+    HEX_VALUES[ord(c)] = i
+
+def read_id_to_key (read_ids, block_size=100000):
+    """
+    Convert an array of read_ids to a compact fixed-width key made of 2 uint64 arrays. Canonical lowercase UUIDs are directly decoded
+    from their 128 bits hexadecimal value. Other read_ids fall back to two independent 64 bits hashes, checked for collisions
+    * read_ids
+        Array or Series of read_id strings
+    * block_size
+        Number of UUIDs decoded at once, to limit the size of the intermediate character arrays
+    """
+    read_ids = np.asarray (read_ids, dtype=object)
+    n = len(read_ids)
+    key_hi = np.zeros (n, dtype=np.uint64)
+    key_lo = np.zeros (n, dtype=np.uint64)
+
+    # Decode UUIDs hex digits, after removing the dashes. Characters are read as unicode code points, non ascii ones being invalid
+    str_len = np.fromiter ((len(i) if isinstance(i, str) else 0 for i in read_ids), dtype=np.int64, count=n)
+    is_uuid = str_len == 36
+    is_dash = np.zeros (36, dtype=bool)
+    is_dash[[8, 13, 18, 23]] = True
+    for idx in np.array_split (np.flatnonzero(is_uuid), max(int(np.ceil(is_uuid.sum()/block_size)), 1)):
+        char_array = np.minimum (read_ids[idx].astype("U36").view(np.uint32).reshape(-1, 36), 255)
+        digits = HEX_VALUES[char_array[:,~is_dash]]
+        valid = (char_array[:,is_dash] == ord("-")).all(axis=1) & (digits != 255).all(axis=1)
+        is_uuid[idx] = valid
+
+        # Pack pairs of digits in bytes read as 2 big-endian 64 bits integers
+        key_bytes = np.ascontiguousarray ((digits[valid,0::2]<<4) | digits[valid,1::2])
+        key_hi[idx[valid]] = key_bytes[:,:8].copy().view(">u8").ravel()
+        key_lo[idx[valid]] = key_bytes[:,8:].copy().view(">u8").ravel()
+
+    # Hash other read_ids
+    if not is_uuid.all():
+        other_ids = read_ids[~is_uuid]
+        key_hi[~is_uuid] = pd.util.hash_array (other_ids, hash_key="pycoQC_read_id_h")
+        key_lo[~is_uuid] = pd.util.hash_array (other_ids, hash_key="pycoQC_read_id_l")
+        key_dup = pd.DataFrame({"hi":key_hi[~is_uuid], "lo":key_lo[~is_uuid]}).duplicated().values
+        if key_dup.any() and not np.array_equal (key_dup, pd.Series(other_ids).duplicated().values):
+            raise pycoQCError ("Hash collision between distinct read_ids")
+
+    return (key_hi, key_lo)
+
+class ReadKeySet ():
+    """
+    Growable set of compact read_id keys, used to identify duplicated reads across chunks. The keys are kept as 2 uint64 arrays
+    sorted by their high part, so the memory usage is 16 bytes per key
+    """
+    def __init__ (self):
+        self.key_hi = np.zeros (0, dtype=np.uint64)
+        self.key_lo = np.zeros (0, dtype=np.uint64)
+
+    def __len__ (self):
+        return len(self.key_hi)
+
+    def first_mask (self, key_hi, key_lo):
+        """
+        Return a boolean array flagging the keys which are neither already in the set nor duplicates of a previous key of the arrays,
+        then add all the keys to the set
+        """
+        key_hi = np.asarray (key_hi, dtype=np.uint64)
+        key_lo = np.asarray (key_lo, dtype=np.uint64)
+        first = ~pd.DataFrame({"hi":key_hi, "lo":key_lo}).duplicated(keep="first").values
+
+        # Keys sharing the high part of a key of the set are compared on their low part
+        start = np.searchsorted (self.key_hi, key_hi, side="left")
+        end = np.searchsorted (self.key_hi, key_hi, side="right")
+        for i in np.flatnonzero (end > start):
+            if (self.key_lo[start[i]:end[i]] == key_lo[i]).any():
+                first[i] = False
+
+        # Merge the new keys with the sorted keys, as a stable sort of 2 sorted runs
+        key_hi = np.concatenate ((self.key_hi, key_hi))
+        order = np.argsort (key_hi, kind="stable")
+        self.key_hi = key_hi[order]
+        self.key_lo = np.concatenate ((self.key_lo, key_lo))[order]
+        return first
+
+def file_fingerprint (fn):
+    """Return a list of absolute path, size and modification time identifying the current version of a file"""
+    st = os.stat(fn)
+    return [path.abspath(fn), st.st_size, st.st_mtime]
+
+def dir_size (dir_path):
+    """Return the total size in bytes of the files contained in a directory"""
+    size = 0
+    for root, dirs, files in os.walk(dir_path):
+        for fn in files:
+            size += path.getsize(path.join(root, fn))
+    return size
+
+def df_to_npy_dir (df, dir_path):
+    """
+    Save a dataframe in a directory with one numpy binary file per column and the columns description in a json file.
+    Object columns of ASCII strings, such as read_ids, are stored as fixed-width bytes arrays which can be memory-mapped.
+    Categorical and other object columns are stored as integer codes plus values arrays
+    * df
+        Dataframe to save
+    * dir_path
+        Path of the directory where to write the files. Created if needed
+    """
+    mkdir (dir_path, exist_ok=True)
+    col_list = []
+
+    # Save index only if it holds information
+    has_index = not ((isinstance(df.index, pd.RangeIndex) or len(df.index) == 0) and df.index.name is None)
+    if has_index:
+        items = [(df.index.name, df.index.to_series())]+list(df.items())
+    else:
+        items = list(df.items())
+
+    for i, (col, s) in enumerate(items):
+        fn = "col_{}".format(i)
+        b = str_to_bytes_array (s.values) if s.dtype == object else None
+        if s.dtype.name == "category":
+            kind = "category"
+            np.save (path.join(dir_path, fn+"_codes.npy"), s.cat.codes.values)
+            np.save (path.join(dir_path, fn+"_values.npy"), np.array(s.cat.categories, dtype=str))
+        elif b is not None:
+            kind = "bytes"
+            np.save (path.join(dir_path, fn+".npy"), b)
+        elif s.dtype == object:
+            kind = "object"
+            codes, values = pd.factorize (s.values)
+            np.save (path.join(dir_path, fn+"_codes.npy"), codes)
+            np.save (path.join(dir_path, fn+"_values.npy"), np.array(values, dtype=str))
+        else:
+            kind = "numeric"
+            np.save (path.join(dir_path, fn+".npy"), s.values)
+        col_list.append ({"name":col, "file":fn, "kind":kind})
+
+    with open (path.join(dir_path, "columns.json"), "w") as fp:
+        json.dump ({"has_index":has_index, "index":df.index.name, "columns":col_list}, fp)
+
+def npy_dir_to_df (dir_path, mmap=True):
+    """
+    Load a dataframe saved with df_to_npy_dir
+    * dir_path
+        Path of the directory containing the files
+    * mmap
+        If True the numpy files are memory-mapped instead of being read. The dataframe is built without copying the arrays, so that
+        the numeric columns and categorical codes remain read-only memory-maps. Strings stored as fixed-width bytes are decoded by blocks
+        from their memory-map
+    """
+    mmap_mode = "r" if mmap else None
+    with open (path.join(dir_path, "columns.json")) as fp:
+        d = json.load(fp)
+
+    array_list = []
+    for col in d["columns"]:
+        fn = path.join(dir_path, col["file"])
+        if col["kind"] == "numeric":
+            a = np.load (fn+".npy", mmap_mode=mmap_mode)
+        elif col["kind"] == "bytes":
+            a = bytes_to_str_array (np.load (fn+".npy", mmap_mode=mmap_mode))
+        else:
+            codes = np.load (fn+"_codes.npy", mmap_mode=mmap_mode)
+            values = np.load (fn+"_values.npy")
+            if col["kind"] == "category":
+                a = pd.Categorical.from_codes (codes, categories=values)
+            else:
+                a = values.astype(object).take(codes)
+                a[codes == -1] = np.nan
+        array_list.append ((col["name"], a))
+
+    # Build the index and the columns without copy, set_index would copy the data
+    index = None
+    if d.get("has_index", d["index"] is not None):
+        index_name, a = array_list.pop (0)
+        index = pd.Index (a, name=index_name, copy=False)
+    return pd.DataFrame (OrderedDict(array_list), index=index, copy=False)
+
+def str_to_bytes_array (a):
+    """
+    Encode an object array of ASCII strings to a fixed-width bytes array. Return None if the array contains other values or strings
+    which cannot be round-tripped, such as non ASCII strings or strings ending with null characters
+    """
+    if pd.api.types.infer_dtype (a, skipna=False) not in ("string", "empty"):
+        return None
+    try:
+        b = a.astype (bytes)
+    except UnicodeEncodeError:
+        return None
+    if len(b) and np.char.str_len(b).sum() != pd.Series(a).str.len().sum():
+        return None
+    return b
+
+def bytes_to_str_array (a, block_size=100000):
+    """Decode a fixed-width bytes array to an object array of strings, by blocks to limit the size of the intermediate unicode arrays"""
+    str_array = np.empty (len(a), dtype=object)
+    for start in range (0, len(a), block_size):
+        str_array[start:start+block_size] = a[start:start+block_size].astype(str)
+    return str_array
+
+def evict_lru_cache (cache_dir, max_size, keep=[]):
+    """
+    Remove the least recently used entries of a cache directory until the total size is below max_size.
+    Entries are sub-directories, ranked by modification time
+    * cache_dir
+        Path of the cache directory
+    * max_size
+        Maximal size in bytes of the cache directory
+    * keep
+        List of entries names never to remove
+    """
+    entry_list = []
+    for entry in listdir(cache_dir):
+        entry_path = path.join(cache_dir, entry)
+        if path.isdir(entry_path):
+            entry_list.append ((path.getmtime(entry_path), dir_size(entry_path), entry))
+
+    # Remove oldest entries first
+    total_size = sum(size for _, size, _ in entry_list)
+    removed = []
+    for _, size, entry in sorted(entry_list):
+        if total_size <= max_size:
+            break
+        if entry in keep:
+            continue
+        shutil.rmtree (path.join(cache_dir, entry), ignore_errors=True)
+        total_size -= size
+        removed.append(entry)
+    return removed
+
 def mkdir (fn, exist_ok=False):
     """ Create directory recursivelly. Raise IO error if path exist or if error at creation """
     try:
         makedirs (fn, exist_ok=exist_ok)
     except:
-        raise pycoMethError ("Error creating output folder `{}`".format(fn))
+        raise pycoQCError ("Error creating output folder `{}`".format(fn))
 
 def mkbasedir (fn, exist_ok=False):
     """ Create directory for a given file recursivelly. Raise IO error if path exist or if error at creation """
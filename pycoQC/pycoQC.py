@@ -31,12 +31,26 @@ def pycoQC (
     min_barcode_percent:float=0.1,
     min_pass_qual:float=7,
     min_pass_len:int=0,
-    sample:int=100000,
+    sample:int=None,
+    quantile_error:float=None,
     html_outfile:str="",
     report_title:str="PycoQC report",
     config_file:str="",
     template_file:str="",
+    report_fast_json:bool=False,
+    report_binary_arrays:bool=False,
+    report_max_points:int=None,
+    report_float_precision:int=None,
+    report_trim_2d:bool=False,
+    report_max_size:float=None,
     json_outfile:str="",
+    chunksize:int=0,
+    compact_read_id:bool=False,
+    threads:int=1,
+    bam_threads:int=1,
+    bam_sample:int=None,
+    cache_dir:str="",
+    cache_max_size:float=20,
     verbose:bool=False,
     quiet:bool=False):
     """
@@ -65,7 +79,10 @@ def pycoQC (
     * min_pass_len
         Minimum read length to consider a read as 'pass'
     * sample
-        If not None a n number of reads will be randomly selected instead of the entire dataset for ploting function (deterministic sampling)
+        Deprecated and ignored. All the plots and statistics are computed from the full data
+    * quantile_error
+        If given, percentiles and medians are estimated from mergeable quantile sketches with this approximative rank error.
+        By default they are computed exactly from the full data
     * html_outfile
         Path to an output html file report
     * report_title
@@ -77,8 +94,41 @@ def pycoQC (
         The second level keys are the parameters to pass to each plotting function
     * template_file
         Jinja2 html template for the html report
+    * report_fast_json
+        If True, the figures of the html report are serialised with a NumPy aware JSON writer instead of plotly default encoder
+    * report_binary_arrays
+        If True with report_fast_json, large numeric arrays of the html report are embedded as base64 typed arrays, decoded in the
+        browser by a small javascript function included in the report
+    * report_max_points
+        If given, the 1D traces of the html report with more points are decimated to about n evenly spaced points
+    * report_float_precision
+        If given, the float values of the html report traces are rounded to n significant digits
+    * report_trim_2d
+        If True, the empty rows and columns at the edges of the 2D matrices of the html report are removed
+    * report_max_size
+        If given, payload budget of the html report plots in MB. Larger reports are progressively reduced by trimming the 2D matrices,
+        rounding the float values and decimating the 1D traces until they fit in the budget
     * json_outfile
         Path to an output json file report
+    * chunksize
+        If given, the summary files are parsed by chunks of n lines and the read level filters are applied on the fly (streaming mode).
+        This reduces the memory usage for very large files
+    * compact_read_id
+        If True in streaming mode, the read_id strings are replaced by compact 128 bits keys to further reduce the memory usage,
+        see pycoQC_parse
+    * threads
+        Number of worker processes to use to parse multiple input files and BAM regions in parallel, and to generate the plots of
+        the html report
+    * bam_threads
+        Number of htslib threads used to decompress each BAM file
+    * bam_sample
+        If given, only about n primary alignments are parsed from randomly selected regions of the BAM files to estimate the alignment
+        metrics (deterministic sampling). The alignments counts are scaled to the total number of mapped reads found in the BAM indexes
+    * cache_dir
+        If given, the parsed and cleaned data are saved in this directory and directly loaded from it in subsequent runs with the same
+        input files and parsing options
+    * cache_max_size
+        Maximal size of the cache directory in GB. The least recently used entries are removed when the size is exceeded
     * verbose
         Increase verbosity
     * quiet
@@ -101,12 +151,26 @@ def pycoQC (
     min_pass_qual = check_arg("min_pass_qual", min_pass_qual, required_type=float, min=0, max=60, allow_none=False)
     min_pass_len = check_arg("min_pass_len", min_pass_len, required_type=int, min=0, allow_none=False)
     sample = check_arg("sample", sample, required_type=int, min=0, allow_none=True)
+    quantile_error = check_arg("quantile_error", quantile_error, required_type=float, min=0, max=1, allow_none=True)
     html_outfile = check_arg("html_outfile", html_outfile, required_type=str, allow_none=True)
     html_outfile = check_arg("html_outfile", html_outfile, required_type=str, allow_none=True)
     report_title = check_arg("report_title", report_title, required_type=str, allow_none=True)
     config_file = check_arg("config_file", config_file, required_type=str, allow_none=True)
     template_file = check_arg("template_file", template_file, required_type=str, allow_none=True)
+    report_max_points = check_arg("report_max_points", report_max_points, required_type=int, min=2, allow_none=True)
+    report_float_precision = check_arg("report_float_precision", report_float_precision, required_type=int, min=1, max=17, allow_none=True)
+    report_trim_2d = check_arg("report_trim_2d", report_trim_2d, required_type=bool, allow_none=False)
+    report_max_size = check_arg("report_max_size", report_max_size, required_type=float, min=0, allow_none=True)
+    report_fast_json = check_arg("report_fast_json", report_fast_json, required_type=bool, allow_none=False)
+    report_binary_arrays = check_arg("report_binary_arrays", report_binary_arrays, required_type=bool, allow_none=False)
     json_outfile = check_arg("json_outfile", json_outfile, required_type=str, allow_none=True)
+    chunksize = check_arg("chunksize", chunksize, required_type=int, min=0, allow_none=False)
+    compact_read_id = check_arg("compact_read_id", compact_read_id, required_type=bool, allow_none=False)
+    threads = check_arg("threads", threads, required_type=int, min=1, allow_none=False)
+    bam_threads = check_arg("bam_threads", bam_threads, required_type=int, min=1, allow_none=False)
+    bam_sample = check_arg("bam_sample", bam_sample, required_type=int, min=0, allow_none=True)
+    cache_dir = check_arg("cache_dir", cache_dir, required_type=str, allow_none=True)
+    cache_max_size = check_arg("cache_max_size", cache_max_size, required_type=float, min=0, allow_none=False)
 
     # Print debug info
     logger.debug("General info")
@@ -123,6 +187,16 @@ def pycoQC (
         filter_calibration=filter_calibration,
         filter_duplicated=filter_duplicated,
         min_barcode_percent=min_barcode_percent,
+        chunksize=chunksize,
+        compact_read_id=compact_read_id,
+        threads=threads,
+        bam_threads=bam_threads,
+        bam_sample=bam_sample,
+        cache_dir=cache_dir,
+        cache_max_size=cache_max_size,
+        quantile_error=quantile_error,
+        min_pass_qual=min_pass_qual,
+        min_pass_len=min_pass_len,
         verbose=verbose,
         quiet=quiet)
 
@@ -135,6 +209,7 @@ def pycoQC (
         min_pass_qual=min_pass_qual,
         min_pass_len=min_pass_len,
         sample=sample,
+        quantile_error=quantile_error,
         verbose=verbose,
         quiet=quiet)
 
@@ -154,7 +229,14 @@ def pycoQC (
                 outfile=html_outfile,
                 config_file=config_file,
                 template_file=template_file,
-                report_title=report_title)
+                report_title=report_title,
+                threads=threads,
+                fast_json=report_fast_json,
+                binary_arrays=report_binary_arrays,
+                max_points=report_max_points,
+                float_precision=report_float_precision,
+                trim_2d=report_trim_2d,
+                max_size=report_max_size)
 
         # Run json output function
         if json_outfile:
@@ -5,6 +5,12 @@
 # Standard library imports
 from collections import *
 import warnings
+import hashlib
+import json
+import os
+from os import path
+import pickle
+import shutil
 
 # Third party imports
 import numpy as np
@@ -13,15 +19,54 @@ import pysam as ps
 
 # Local lib import
 from pycoQC.common import *
+from pycoQC import __version__ as package_version
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~GLOBAL SETTINGS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
 # Silence futurewarnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+# Seed for deterministic BAM regions sampling
+SEED = 42
+
+# Read filter stage definition. func(df, mask) returns a boolean array of the reads to keep, given the mask of the reads retained by the previous stages
+read_filter = namedtuple ("read_filter", ["msg", "name", "label", "func"])
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~MAIN CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class pycoQC_parse ():
 
+    # Standard column names and accepted alias names in sequencing summary files, by order of preference
+    summary_colnames_dict = OrderedDict ((
+        ("read_id", ["read_id"]),
+        ("run_id", ["run_id"]),
+        ("channel", ["channel"]),
+        ("start_time", ["start_time"]),
+        ("read_len", ["sequence_length_template", "sequence_length_2d", "sequence_length", "read_len"]),
+        ("mean_qscore", ["mean_qscore_template", "mean_qscore_2d", "mean_qscore"]),
+        ("calibration", ["calibration_strand_genome_template", "calibration"]),
+        ("barcode", ["barcode_arrangement", "barcode"])))
+
+    # Standard column names and accepted alias names in Guppy and Deepbinner barcode files
+    barcode_colnames_dict = OrderedDict ((
+        ("read_id", ["read_id", "read_ID"]),
+        ("barcode", ["barcode_arrangement", "barcode_call"])))
+
+    # Compact types in which the values are directly parsed
+    colnames_dtype_dict = {
+        "run_id":"category",
+        "channel":"uint16",
+        "start_time":"float64",
+        "read_len":"uint32",
+        "mean_qscore":"float32",
+        "calibration":"category",
+        "barcode":"category"}
+
+    # Number of BAM regions parsed per worker process, to balance the load between workers
+    bam_regions_per_thread = 10
+
+    # Average number of mapped reads per window in which BAM files are split to randomly select regions in sampled mode
+    bam_sample_window_reads = 100
+
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~INIT METHOD~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
     def __init__ (self,
         summary_file:str,
@@ -32,6 +77,18 @@ class pycoQC_parse ():
         filter_duplicated:bool=False,
         min_barcode_percent:float=0.1,
         cleanup:bool=True,
+        extra_read_filters:list=[],
+        extra_colnames:list=[],
+        chunksize:int=0,
+        compact_read_id:bool=False,
+        threads:int=1,
+        bam_threads:int=1,
+        bam_sample:int=None,
+        cache_dir:str="",
+        cache_max_size:float=20,
+        quantile_error:float=None,
+        min_pass_qual:float=7,
+        min_pass_len:int=0,
         verbose:bool=False,
         quiet:bool=False):
         """
@@ -55,6 +112,45 @@ class pycoQC_parse ():
             If True duplicated read_ids are removed but the first occurence is kept (Guppy sometimes outputs the same read multiple times)
         * min_barcode_percent
             Minimal percent of total reads to retain barcode label. If below the barcode value is set as `unclassified`.
+        * cleanup
+            If True the data are cleaned-up and only the columns used by pycoQC are retained
+        * extra_read_filters
+            List of additional read_filter stages applied during the clean-up after all the default filters. For example to select a range
+            of channels:
+            read_filter (msg="Selecting channels 1 to 256", name="channel", label="Excluded channel reads discarded",
+            func=lambda df, mask: df["channel"] <= 256)
+            Only the standard columns are available to the filters, unless additional columns are requested with extra_colnames
+        * extra_colnames
+            List of additional sequencing summary columns to parse, for example to be used by extra_read_filters. The columns are retained
+            under their name in the file header and must be found in all the summary files. For example a minimal duration filter
+            requires extra_colnames=["duration"]
+        * chunksize
+            If given, the summary files are parsed sequentially by chunks of n lines and the read level filters are applied to each chunk
+            on the fly (streaming mode), in the same order as in default mode. This reduces the memory usage for very large files
+        * compact_read_id
+            If True in streaming mode, the read_id strings are not retained and the reads are not indexed by read_id. Instead, read_ids are
+            stored as compact 128 bits keys in the read_key_hi and read_key_lo uint64 columns. For UUID read_ids, the key is the integer value
+            of the UUID and other read_ids are hashed
+        * threads
+            Number of worker processes to use to parse multiple input files and BAM regions in parallel
+        * bam_threads
+            Number of htslib threads used to decompress each BAM file
+        * bam_sample
+            If given, only about n primary alignments are parsed from randomly selected regions of the BAM files to estimate the alignment
+            metrics (deterministic sampling). The alignments counts are scaled to the total number of mapped reads found in the BAM indexes
+        * cache_dir
+            If given, the parsed and cleaned data are saved in this directory and directly loaded from it in subsequent runs with the same
+            input files and parsing options
+        * cache_max_size
+            Maximal size of the cache directory in GB. The least recently used entries are removed when the size is exceeded
+        * quantile_error
+            If given, quantile sketches with this approximative rank error are filled with the numeric fields of all and pass reads while
+            the data are parsed. In streaming mode, the summary fields are added to the sketches chunk by chunk. The sketches are used by
+            pycoQC_plot to estimate the percentiles and medians
+        * min_pass_qual
+            Minimum quality to consider a read as 'pass' in the quantile sketches of pass reads
+        * min_pass_len
+            Minimum read length to consider a read as 'pass' in the quantile sketches of pass reads
         """
 
         # Set logging level
@@ -66,9 +162,23 @@ class pycoQC_parse ():
         self.filter_duplicated = filter_duplicated
         self.min_barcode_percent = min_barcode_percent
         self.cleanup = cleanup
-
-        # Init object counter
+        self.extra_read_filters = extra_read_filters
+        self.extra_colnames = extra_colnames
+        self.chunksize = chunksize
+        self.compact_read_id = compact_read_id
+        self.threads = threads
+        self.bam_threads = bam_threads
+        self.bam_sample = bam_sample
+        self.cache_dir = cache_dir
+        self.cache_max_size = cache_max_size
+        self.quantile_error = quantile_error
+        self.min_pass_qual = min_pass_qual
+        self.min_pass_len = min_pass_len
+
+        # Init object counter, fraction of the BAM alignments parsed and quantile sketches
         self.counter = OrderedDict()
+        self.bam_scaling_factor = 1
+        self.sketch_dict = OrderedDict()
 
         # Check input files
         self.logger.warning ("Check input data files")
@@ -92,6 +202,18 @@ class pycoQC_parse ():
         else:
             self.bam_file_list =[]
 
+        # Load data from cache if the same files were already parsed with the same options. User defined filters cannot be compared
+        if self.cache_dir and self.extra_read_filters:
+            self.logger.warning ("Cache disabled with extra read filters")
+            self.cache_dir = ""
+        if self.cache_dir:
+            cache_key = self._cache_key()
+            cache_path = path.join(self.cache_dir, cache_key)
+            if path.isdir(cache_path):
+                self.logger.warning ("Load parsed data from cache")
+                self._load_cache(cache_path)
+                return
+
         self.logger.warning ("Parse data files")
         summary_reads_df = self._parse_summary()
         barcode_reads_df = self._parse_barcode()
@@ -105,6 +227,15 @@ class pycoQC_parse ():
             self.logger.warning("Cleaning data")
             self.reads_df = self._clean_reads_df(self.reads_df)
 
+            # Fill the quantile sketches of the fields not already added by chunks
+            if self.quantile_error:
+                self._fill_sketches (self.reads_df)
+
+        # Save data to cache
+        if self.cache_dir:
+            self.logger.warning ("Save parsed data to cache")
+            self._save_cache(cache_path)
+
     def __str__(self):
         return dict_to_str(self.counter)
 
@@ -116,28 +247,29 @@ class pycoQC_parse ():
     def _parse_summary (self):
         """"""
         self.logger.debug ("\tParse summary files")
-        df = merge_files_to_df (self.summary_files_list)
+
+        if self.cleanup and self.chunksize:
+            return self._parse_summary_chunks ()
 
         if self.cleanup:
-            # Standardise col names for all types of files
-            self.logger.debug ("\tRename summary sequencing columns")
-            rename_colmanes = {
-                "sequence_length_template":"read_len",
-                "sequence_length_2d":"read_len",
-                "sequence_length":"read_len",
-                "mean_qscore_template":"mean_qscore",
-                "mean_qscore_2d":"mean_qscore",
-                "calibration_strand_genome_template":"calibration",
-                "barcode_arrangement":"barcode"}
-            df = df.rename(columns=rename_colmanes)
-
-            # Verify the required and optional columns, Drop unused fields
-            self.logger.debug ("\tVerifying fields and discarding unused columns")
+            # Only parse required and optional fields, with standardised col names and compact types
+            self.logger.debug ("\tParse required and optional columns")
+            df = merge_files_to_df (
+                fn_list = self.summary_files_list,
+                colnames_dict = self._get_summary_colnames_dict (),
+                dtype_dict = self.colnames_dtype_dict,
+                threads = self.threads)
+
+            # Verify the required and optional columns
+            self.logger.debug ("\tVerifying fields")
             df = self._select_df_columns (
                 df = df,
-                required_colnames = ["read_id", "run_id", "channel", "start_time", "read_len", "mean_qscore"],
+                required_colnames = ["read_id", "run_id", "channel", "start_time", "read_len", "mean_qscore"]+self.extra_colnames,
                 optional_colnames = ["calibration", "barcode"])
 
+        else:
+            df = merge_files_to_df (self.summary_files_list, threads=self.threads)
+
         # Collect stats
         n = len(df)
         self.logger.debug ("\t\t{:,} reads found in initial file".format(n))
@@ -145,27 +277,107 @@ class pycoQC_parse ():
 
         return df
 
+    def _get_summary_colnames_dict (self):
+        """Return the dict of standard summary column names and alias names, extended with the extra columns requested by the user"""
+        colnames_dict = OrderedDict (self.summary_colnames_dict)
+        for col in self.extra_colnames:
+            if any (col == colname or col in alias_list for colname, alias_list in self.summary_colnames_dict.items()):
+                raise pycoQCError ("Column {} is already parsed as a standard column".format(col))
+            colnames_dict[col] = [col]
+        return colnames_dict
+
+    def _parse_summary_chunks (self):
+        """"""
+        self.logger.debug ("\tParse summary files by chunks of {:,} lines".format(self.chunksize))
+
+        # Optional columns present in any of the files are retained and filled with NA values for the other files
+        colnames_dict = self._get_summary_colnames_dict ()
+        optional_colnames = ["calibration", "barcode"]
+
+        # Init counters for the filters applied on the fly and the keys of the reads already parsed to find duplicated reads across chunks
+        n_initial = 0
+        counter = Counter()
+        col_dict_list = []
+        read_key_set = ReadKeySet () if self.filter_duplicated else None
+
+        for fn in self.summary_files_list:
+            for df in iter_file_chunks (
+                fn = fn,
+                chunksize = self.chunksize,
+                colnames_dict = colnames_dict,
+                dtype_dict = self.colnames_dtype_dict):
+
+                # Verify the required and optional columns
+                df = self._select_df_columns (
+                    df = df,
+                    required_colnames = ["read_id", "run_id", "channel", "start_time", "read_len", "mean_qscore"]+self.extra_colnames,
+                    optional_colnames = optional_colnames)
+                n_initial += len(df)
+
+                # Compute the compact read_id keys if needed to find duplicated reads or to replace the read_id strings
+                if self.filter_duplicated or self.compact_read_id:
+                    key_hi, key_lo = read_id_to_key (df["read_id"])
+                    df = df.assign (read_key_hi=key_hi, read_key_lo=key_lo)
+
+                # Apply read level filters
+                df, chunk_counter = self._apply_read_filters (df, self._get_chunk_filters(df.columns, read_key_set), chunk=True)
+                counter.update (chunk_counter)
+
+                # Cast integer fields now that NA values were removed and only keep compact column arrays
+                df = df.astype({col:dtype for col, dtype in self.colnames_dtype_dict.items() if col in df and is_integer_dtype(dtype)})
+                if self.compact_read_id:
+                    drop_cols = ["read_id"]
+                else:
+                    drop_cols = ["read_key_hi", "read_key_lo"]
+                col_dict = OrderedDict ((col, df[col].values) for col in df.columns if not col in drop_cols)
+                col_dict_list.append (col_dict)
+
+                # Add the retained reads to the quantile sketches, unless user defined filters can still remove reads
+                if self.quantile_error and not self.extra_read_filters:
+                    self._update_sketches (df, ["read_len", "mean_qscore"])
+
+        # Concatenate retained reads once
+        if not col_dict_list:
+            raise pycoQCError ("No valid read found in input file")
+        df = concat_columns_to_df (col_dict_list)
+
+        # Collect stats
+        self.logger.debug ("\t\t{:,} reads found in initial file".format(n_initial))
+        self.counter["Initial reads"] = n_initial
+        for f in self._get_chunk_filters (df.columns, read_key_set):
+            self.logger.info ("\t\t{:,} reads discarded by {} filtering".format(counter[f.label], f.name))
+            self.counter[f.label] = counter[f.label]
+        if len(df) <= 1:
+            raise pycoQCError("No valid read left after read filtering")
+
+        return df
+
     def _parse_barcode (self):
         """"""
         if not self.barcode_files_list:
             return pd.DataFrame()
 
         self.logger.debug ("\tParse barcode files")
-        df = merge_files_to_df (self.barcode_files_list)
 
         # check presence of barcode details
-        if "read_id" in df and "barcode_arrangement" in df:
+        header = get_file_header (self.barcode_files_list[0])
+        if "read_id" in header and "barcode_arrangement" in header:
             self.logger.debug ("\t\tFound valid Guppy barcode file")
-            df = df [["read_id", "barcode_arrangement"]]
-            df = df.rename(columns={"barcode_arrangement":"barcode"})
-
-        elif "read_ID" in df and "barcode_call" in df:
+        elif "read_ID" in header and "barcode_call" in header:
             self.logger.debug ("\t\tFound valid Deepbinner barcode file")
-            df = df [["read_ID", "barcode_call"]]
-            df = df.rename(columns={"read_ID":"read_id", "barcode_call":"barcode"})
-            df['barcode'].replace("none", "unclassified", inplace=True)
         else:
-            raise pycoQCError ("File {} does not contain required barcode information".format(fp))
+            raise pycoQCError ("File {} does not contain required barcode information".format(self.barcode_files_list[0]))
+
+        df = merge_files_to_df (
+            fn_list = self.barcode_files_list,
+            colnames_dict = self.barcode_colnames_dict,
+            dtype_dict = self.colnames_dtype_dict,
+            threads = self.threads)
+
+        # Standardise Deepbinner unclassified value and make sure unclassified is a valid category
+        df['barcode'] = df['barcode'].replace("none", "unclassified")
+        if not "unclassified" in df['barcode'].cat.categories:
+            df['barcode'] = df['barcode'].cat.add_categories("unclassified")
 
         n = len(df[df['barcode']!="unclassified"])
         self.logger.debug ("\t\t{:,} reads with barcodes assigned".format(n))
@@ -178,34 +390,99 @@ class pycoQC_parse ():
         if not self.bam_file_list:
             return (pd.DataFrame(), pd.DataFrame(), OrderedDict())
 
-        # Init collections
-        ref_len_dict = OrderedDict()
+        # Count mapped and unmapped reads from the BAM indexes
+        mapped = unmapped = 0
+        for bam_fn in self.bam_file_list:
+            with ps.AlignmentFile(bam_fn, "rb") as bam:
+                mapped += bam.mapped
+                # The unmapped count of the index includes the reads without coordinates
+                unmapped += bam.unmapped
         alignments_dict = Counter()
-        read_dict = OrderedDict ()
+        alignments_dict["Unmapped"] = unmapped
 
+        # Only parse a random subset of regions if bam_sample is smaller than the number of mapped reads
+        sample_frac = self.bam_sample/mapped if self.bam_sample and mapped else 1
+        n_groups = self.threads*self.bam_regions_per_thread
+        if sample_frac < 1:
+            self.logger.info ("\tSampling regions to parse about {:,} out of {:,} mapped reads".format(self.bam_sample, mapped))
+            rng = np.random.RandomState (seed=SEED)
+
+        # List regions to parse from the BAM indexes and save reference lengths information
+        ref_len_dict = OrderedDict()
+        group_list = []
+        ref_idx_dict = {}
         for bam_fn in self.bam_file_list:
             with ps.AlignmentFile(bam_fn, "rb") as bam:
-
-                # Save reference lengths information
                 for ref_id, ref_len in zip(bam.references, bam.lengths):
                     if not ref_id in ref_len_dict:
                         ref_len_dict[ref_id] = ref_len
+                # Index of BAM header references in the list of all references
+                ref_idx_dict[bam_fn] = np.array([list(ref_len_dict).index(ref_id) for ref_id in bam.references], dtype="int32")
+                if sample_frac < 1:
+                    # Split the file in small windows containing about the same number of reads and select them with the same
+                    # probability, so that every read has the same probability to be sampled and the sampled reads are spread over
+                    # the whole genome
+                    n_selected = max (int(round(bam.mapped*sample_frac/self.bam_sample_window_reads)), 1)
+                    bam_region_list = get_bam_regions (bam, reads_per_region=self.bam_sample_window_reads, n_selected=n_selected, rng=rng)
+                else:
+                    bam_region_list = get_bam_regions (bam, n_regions=n_groups)
+                # Group consecutive regions to parse them with a single open file
+                for idx in np.array_split (np.arange(len(bam_region_list)), min(n_groups, len(bam_region_list))):
+                    group_list.append ([bam_region_list[i] for i in idx])
+        self.logger.debug ("\t\tParsing {:,} BAM regions in {:,} groups".format(sum(len(group) for group in group_list), len(group_list)))
+
+        # Parse groups of regions, in parallel worker processes if required. Results are returned in group order
+        worker = partial (parse_bam_regions, bam_threads=self.bam_threads)
+        if self.threads > 1 and len(group_list) > 1:
+            with mp.Pool (min(self.threads, len(group_list))) as pool:
+                result_list = pool.map (worker, group_list)
+        else:
+            result_list = [worker(group) for group in group_list]
+
+        # Concatenate region arrays
+        col_dict_list = []
+        for group, (group_alignments_dict, group_col_dict) in zip (group_list, result_list):
+            alignments_dict.update (group_alignments_dict)
+            if len(group_col_dict["read_id"]):
+                group_col_dict["ref_id"] = ref_idx_dict[group[0][0]][group_col_dict["ref_id"]]
+                col_dict_list.append (group_col_dict)
+
+        if col_dict_list:
+            col_dict = OrderedDict ((col, np.concatenate([d[col] for d in col_dict_list])) for col in col_dict_list[0])
+
+            # Keep the first primary alignment of each read
+            duplicated = duplicated_str_array (col_dict["read_id"])
+            alignments_dict["Primary"] = int((~duplicated).sum())
+            alignments_dict["Duplicated"] = int(duplicated.sum())
+            if alignments_dict["Duplicated"]:
+                col_dict = OrderedDict ((col, array[~duplicated]) for col, array in col_dict.items())
+
+            # Mismatch and identity are only defined if NM or MD tags are available
+            has_score = col_dict.pop ("has_score")
+            if not has_score.any():
+                del col_dict["mismatch"], col_dict["identity_freq"]
+            elif not has_score.all():
+                col_dict["mismatch"] = np.where (has_score, col_dict["mismatch"], np.nan).astype("float32")
+                col_dict["identity_freq"][~has_score] = np.nan
+
+            # Build df directly from the arrays
+            col_dict["ref_id"] = pd.Categorical.from_codes (col_dict["ref_id"], categories=list(ref_len_dict))
+            read_df = pd.DataFrame (col_dict, copy=False)
+        else:
+            read_df = pd.DataFrame()
 
-                # Parse reads
-                for read in bam:
-                    if read.is_unmapped:
-                        alignments_dict["Unmapped"]+=1
-                    elif read.is_secondary:
-                        alignments_dict["Secondary"]+=1
-                    elif read.is_supplementary:
-                        alignments_dict["Suplementary"]+=1
-                    elif read.query_name in read_dict:
-                        alignments_dict["Duplicated"]+=1
-                    else:
-                        alignments_dict["Primary"]+=1
-                        read_dict[read.query_name] = self._get_read_stats(read)
+        # Scale the mapped alignments counts to the total number of mapped reads from the indexes
+        if sample_frac < 1:
+            parsed = sum(alignments_dict[k] for k in ("Primary", "Secondary", "Suplementary", "Duplicated"))
+            if not parsed:
+                raise pycoQCError ("No alignment found in sampled BAM regions. Try to increase bam_sample")
+            self.bam_scaling_factor = mapped/parsed
+            self.logger.info ("\t\t{:,} sampled mapped reads / scaling factor: {:.2f}".format(parsed, self.bam_scaling_factor))
+            for k in ("Primary", "Secondary", "Suplementary", "Duplicated"):
+                alignments_dict[k] = int(round(alignments_dict[k]*self.bam_scaling_factor))
 
         # Convert aligments_dict to df
+        alignments_dict = OrderedDict ((k, alignments_dict[k]) for k in ("Primary", "Secondary", "Suplementary", "Unmapped", "Duplicated") if alignments_dict[k])
         if alignments_dict:
             alignments_df = pd.DataFrame.from_dict(alignments_dict, orient="index")
             alignments_df.reset_index(inplace=True)
@@ -214,107 +491,79 @@ class pycoQC_parse ():
         else:
             alignments_df = pd.DataFrame()
 
-        # Convert read_dict to df
-        if read_dict:
-            read_df = pd.DataFrame.from_dict(read_dict, orient="index")
-            read_df.index.name="read_id"
-            read_df.reset_index(inplace=True)
-        else:
-            read_df = pd.DataFrame()
-
         return (read_df, alignments_df, ref_len_dict)
 
     def _merge_reads_df(self, summary_reads_df, barcode_reads_df, bam_reads_df):
         """"""
         df = summary_reads_df
+        if barcode_reads_df.empty and bam_reads_df.empty:
+            return df
+
+        # Join on compact read_id keys computed once per df instead of the read_id strings. With compact_read_id the keys are already available
+        key_cols = ["read_key_hi", "read_key_lo"]
+        streaming = "read_key_hi" in df
+        if not streaming:
+            df = self._add_read_key (df)
 
         # Merge df and fill in missing barcode values
         if not barcode_reads_df.empty:
-            df = pd.merge(df, barcode_reads_df, on="read_id", how="left")
+            barcode_reads_df = self._add_read_key (barcode_reads_df).drop(columns="read_id")
+            df = pd.merge(df, barcode_reads_df, on=key_cols, how="left")
             df['barcode'].fillna('unclassified', inplace=True)
 
         # Merge df and fill in missing barcode values
         if not bam_reads_df.empty:
-            df = pd.merge(df, bam_reads_df, on="read_id", how="left")
+            bam_reads_df = self._add_read_key (bam_reads_df).drop(columns="read_id")
+            df = pd.merge(df, bam_reads_df, on=key_cols, how="left")
 
-        return df
+        return df if streaming else df.drop(columns=key_cols)
+
+    def _add_read_key (self, df):
+        """Return a copy of df with the 2 columns of the compact read_id key"""
+        key_hi, key_lo = read_id_to_key (df["read_id"])
+        return df.assign (read_key_hi=key_hi, read_key_lo=key_lo)
 
     def _clean_reads_df (self, df):
         """"""
-        # Drop lines containing NA values
-        self.logger.info ("\tDiscarding lines containing NA values")
-        l = len(df)
-        df = df.dropna(subset=["read_id", "run_id", "channel", "start_time", "read_len", "mean_qscore"])
-        n=l-len(df)
-        self.logger.info ("\t\t{:,} reads discarded".format(n))
-        self.counter["Reads with NA values discarded"] = n
-        if len(df) <= 1:
-            raise pycoQCError("No valid read left after NA values filtering")
-
-        # Filter out zero length reads
-        self.logger.info ("\tFiltering out zero length reads")
-        l = len(df)
-        df = df[(df["read_len"] > 0)]
-        n=l-len(df)
-        self.logger.info ("\t\t{:,} reads discarded".format(n))
-        self.counter["Zero length reads discarded"] = n
-        if len(df) <= 1:
-            raise pycoQCError("No valid read left after zero_len filtering")
+        # Apply read filters. In streaming mode the default read level filters were already applied by chunks at parsing time
+        df, counter = self._apply_read_filters (df, self._get_read_filters(df.columns, streaming=bool(self.chunksize)))
+        self.counter.update (counter)
 
-        # Filter out reads with duplicated read_id
-        if self.filter_duplicated:
-            self.logger.info ("\tFiltering out duplicated reads")
-            l = len(df)
-            df = df[~df.duplicated(subset="read_id", keep='first')]
-            n=l-len(df)
-            self.logger.info ("\t\t{:,} reads discarded".format(n))
-            self.counter["Duplicated reads discarded"] = n
-            if len(df) <= 1:
-                raise pycoQCError("No valid read left after calibration strand filtering")
-
-        # Filter out calibration strand reads if the "calibration_strand_genome_template" field is available
-        if self.filter_calibration and "calibration" in df:
-            self.logger.info ("\tFiltering out calibration strand reads")
-            l = len(df)
-            df = df[(df["calibration"].isin(["filtered_out", "no_match", "*"]))]
-            n=l-len(df)
-            self.logger.info ("\t\t{:,} reads discarded".format(n))
-            self.counter["Calibration reads discarded"] = n
-            if len(df) <= 1:
-                raise pycoQCError("No valid read left after calibration strand filtering")
-
-        # Filter and reorder based on runid_list list if passed by user
+        # Compute the number of reads and start time range of all run ids in a single pass
+        run_codes, run_ids = pd.factorize (df["run_id"])
+        run_stats = pd.DataFrame ({"run_code":run_codes, "start_time":df["start_time"].values}).groupby("run_code")["start_time"].agg(["count", "min", "max"])
+        run_stats.index = np.asarray(run_ids)[run_stats.index]
+
+        # Reorder based on runid_list list if passed by user
         if self.runid_list:
-            self.logger.info ("\tSelecting run_ids passed by user")
-            l = len(df)
-            df = df[(df["run_id"].isin(self.runid_list))]
-            n=l-len(df)
-            self.logger.debug ("\t\t{:,} reads discarded".format(n))
-            self.counter["Excluded runid reads discarded"] = n
-            if len(df) <= 1:
-                raise pycoQCError("No valid read left after run ID filtering")
-            runid_list = self.runid_list
+            runid_list = [runid for runid in self.runid_list if runid in run_stats.index]
 
         # Else sort the runids by output per time assuming that the throughput decreases over time
         else:
             self.logger.info ("\tSorting run IDs by decreasing throughput")
-            d = {}
-            for run_id, sdf in df.groupby("run_id"):
-                d[run_id] = len(sdf)/np.ptp(sdf["start_time"])
-            runid_list = [i for i, j in sorted (d.items(), key=lambda t: t[1], reverse=True)]
+            throughput = run_stats["count"]/(run_stats["max"]-run_stats["min"])
+            runid_list = list(throughput.sort_values(ascending=False, kind="mergesort").index)
             self.logger.info ("\t\tRun-id order {}".format(runid_list))
 
-        # Modify start time per run ids to order them following the runid_list
+        # Modify start time per run ids to order them following the runid_list. Offsets are applied in a single gather on the float64
+        # start times and the reads are sorted with the same algorithm as sort_values, before casting the start times to float32
         self.logger.info ("\tReordering runids")
-        increment_time = 0
-        runid_start = OrderedDict()
-        for runid in runid_list:
+        max_val = run_stats["max"][runid_list]
+        offset = (max_val+1).cumsum().shift(1, fill_value=0)
+        for runid, increment_time in offset.items():
             self.logger.info ("\t\tProcessing reads with Run_ID {} / time offset: {}".format(runid, increment_time))
-            max_val = df['start_time'][df["run_id"] == runid].max()
-            df.loc[df["run_id"] == runid, 'start_time'] += increment_time
-            runid_start[runid] = increment_time
-            increment_time += max_val+1
-        df = df.sort_values ("start_time")
+        run_offset = offset.reindex(run_ids).fillna(0).values
+        start_time = df["start_time"].values.astype(np.float64) + run_offset[run_codes]
+        order = np.argsort (start_time, kind="quicksort")
+        df = df.take (order)
+        df["start_time"] = start_time[order].astype(np.float32)
+
+        # Reads from summary files without barcode column are unclassified
+        if "barcode" in df:
+            if df["barcode"].dtype.name == "category" and not "unclassified" in df["barcode"].cat.categories:
+                df["barcode"] = df["barcode"].cat.add_categories("unclassified")
+            if df["barcode"].isna().any():
+                df["barcode"] = df["barcode"].fillna("unclassified")
 
         #  Unset low frequency barcodes
         if "barcode" in df and self.min_barcode_percent:
@@ -330,12 +579,21 @@ class pycoQC_parse ():
 
         # Cast values to required types
         self.logger.info ("\tCast value to appropriate type")
-        df = df.astype({'channel':"uint16","start_time":"float32","read_len":"uint32","mean_qscore":"float32"})
+        dtype_dict = {'channel':"uint16","start_time":"float32","read_len":"uint32","mean_qscore":"float32"}
+        df = df.astype({col:dtype for col, dtype in dtype_dict.items() if df[col].dtype != dtype})
+        for col in ("run_id", "calibration", "barcode"):
+            if col in df and df[col].dtype.name == "category":
+                df[col] = df[col].cat.remove_unused_categories()
 
         # Reindex final df
         self.logger.info ("\tReindexing dataframe by read_ids")
-        df = df.reset_index (drop=True)
-        df = df.set_index ("read_id")
+        # With compact_read_id read_ids are only available as compact keys columns
+        if "read_key_hi" in df:
+            df.index = pd.RangeIndex (len(df))
+        else:
+            read_id = df["read_id"].values
+            df = df.drop (columns="read_id")
+            df.index = pd.Index (read_id, dtype=object, name="read_id", copy=False)
         self.logger.info ("\t\t{:,} Final valid reads".format(len(df)))
 
         # Save final df
@@ -345,46 +603,163 @@ class pycoQC_parse ():
 
         return df
 
-    def _get_read_stats(self, read):
+    def _cache_key (self):
+        """Compute a cache key from the input files fingerprints and the options affecting the parsed data"""
+        d = OrderedDict ()
+        d["version"] = package_version
+        d["summary_files"] = [file_fingerprint(fn) for fn in self.summary_files_list]
+        d["barcode_files"] = [file_fingerprint(fn) for fn in self.barcode_files_list]
+        d["bam_files"] = [file_fingerprint(fn) for fn in self.bam_file_list]
+        d["runid_list"] = self.runid_list
+        d["filter_calibration"] = self.filter_calibration
+        d["filter_duplicated"] = self.filter_duplicated
+        d["min_barcode_percent"] = self.min_barcode_percent
+        d["cleanup"] = self.cleanup
+        d["extra_colnames"] = self.extra_colnames
+        d["compact_read_id"] = bool(self.chunksize) and self.compact_read_id
+        d["bam_sample"] = self.bam_sample
+        d["sketches"] = [self.quantile_error, self.min_pass_qual, self.min_pass_len] if self.quantile_error else None
+        return hashlib.sha1(json.dumps(d).encode()).hexdigest()
+
+    def _load_cache (self, cache_path):
         """"""
-        d = OrderedDict()
-
-        # Extract general stats
-        d["ref_id"] = read.reference_name
-        d["ref_start"] = read.reference_start
-        d["ref_end"] = read.reference_end
-        d["align_len"] = read.query_alignment_length
-        d["mapq"] = read.mapping_quality
-
-        # Extract indel and soft_clip from cigar
-        c_stat = read.get_cigar_stats()[0]
-        d["insertion"] = c_stat[1]
-        d["deletion"] = c_stat[2]
-        d["soft_clip"] = c_stat[4]
-
-        # Compute alignment score from NM field if available
-        if read.has_tag("NM"):
-            edit_dist = read.get_tag("NM")
-            d["mismatch"] = edit_dist-(d["deletion"]+d["insertion"])
-            try:
-                d["identity_freq"] = (d["align_len"]-edit_dist)/d["align_len"]
-            except ZeroDivisionError:
-                d["identity_freq"] = 0
-
-        # If not NM try to compute score from MD field
-        elif read.has_tag("MD"):
-            md_err = 0
-            for i in read.get_tag("MD"):
-                if i in ["A","T","C","G","a","t","c","g"]:
-                    md_err += 1
-            d["mismatch"] = md_err-d["deletion"]
-            edit_dist = d["mismatch"]+d["insertion"]+d["deletion"]
-            try:
-                d["identity_freq"] = (d["align_len"]-edit_dist)/d["align_len"]
-            except ZeroDivisionError:
-                d["identity_freq"] = 0
+        self.logger.debug ("\tLoading data from {}".format(cache_path))
+        self.reads_df = npy_dir_to_df (path.join(cache_path, "reads"), mmap=True)
+        self.alignments_df = npy_dir_to_df (path.join(cache_path, "alignments"), mmap=False)
+        with open (path.join(cache_path, "info.json")) as fp:
+            d = json.load (fp, object_pairs_hook=OrderedDict)
+        self.ref_len_dict = d["ref_len_dict"]
+        self.counter = d["counter"]
+        self.bam_scaling_factor = d["bam_scaling_factor"]
+        if path.isfile (path.join(cache_path, "sketches.pkl")):
+            with open (path.join(cache_path, "sketches.pkl"), "rb") as fp:
+                self.sketch_dict = pickle.load (fp)
+
+        # Update modification time for LRU eviction
+        os.utime (cache_path)
+        self.logger.debug ("\t\t{:,} reads loaded".format(len(self.reads_df)))
+
+    def _save_cache (self, cache_path):
+        """"""
+        self.logger.debug ("\tSaving data to {}".format(cache_path))
+
+        # Write in a temporary directory first, so that incomplete entries are never loaded
+        tmp_path = "{}.tmp{}".format(cache_path, os.getpid())
+        df_to_npy_dir (self.reads_df, path.join(tmp_path, "reads"))
+        df_to_npy_dir (self.alignments_df, path.join(tmp_path, "alignments"))
+        with open (path.join(tmp_path, "info.json"), "w") as fp:
+            json.dump ({"ref_len_dict":self.ref_len_dict, "counter":self.counter, "bam_scaling_factor":self.bam_scaling_factor}, fp)
+        if self.sketch_dict:
+            with open (path.join(tmp_path, "sketches.pkl"), "wb") as fp:
+                pickle.dump (self.sketch_dict, fp)
+        try:
+            os.rename (tmp_path, cache_path)
+        except OSError:
+            shutil.rmtree (tmp_path, ignore_errors=True)
+
+        # Remove least recently used entries if the cache is too large
+        removed = evict_lru_cache (self.cache_dir, max_size=self.cache_max_size*1e9, keep=[path.basename(cache_path)])
+        for entry in removed:
+            self.logger.debug ("\t\tRemoved old cache entry {}".format(entry))
+
+    def _update_sketches (self, df, field_names):
+        """Add the values of some numeric fields of a chunk of reads to the quantile sketches of all and pass reads"""
+        pass_df = df[((df["mean_qscore"]>=self.min_pass_qual) & (df["read_len"]>=self.min_pass_len)).values]
+        for df_level, level_df in (("all", df), ("pass", pass_df)):
+            for field_name in field_names:
+                if not (df_level, field_name) in self.sketch_dict:
+                    self.sketch_dict[(df_level, field_name)] = QuantileSketch (eps=self.quantile_error, seed=SEED)
+                self.sketch_dict[(df_level, field_name)].update (level_df[field_name].values)
+
+    def _fill_sketches (self, df, chunksize=1000000):
+        """Add the numeric fields of the final reads which are not yet in the quantile sketches, by chunks of reads"""
+        field_names = [f for f in ("read_len", "mean_qscore", "align_len", "identity_freq") if f in df and not ("all", f) in self.sketch_dict]
+        if not field_names:
+            return
+        self.logger.info ("	Filling quantile sketches of {}".format(", ".join(field_names)))
+        for start in range (0, len(df), chunksize):
+            self._update_sketches (df.iloc[start:start+chunksize], field_names)
+
+    def _get_chunk_filters (self, colnames, read_key_set=None):
+        """
+        List the read level filters that can be applied to chunks of reads as read_filter tuples, in order of application.
+        colnames is the list of available columns. In streaming mode, duplicated reads are identified across chunks with read_key_set,
+        the ReadKeySet of the reads of the previous chunks
+        """
+        filter_list = [
+            read_filter (
+                msg = "Discarding lines containing NA values",
+                name = "NA values",
+                label = "Reads with NA values discarded",
+                func = lambda df, mask: df[["read_id", "run_id", "channel", "start_time", "read_len", "mean_qscore"]].notna().all(axis=1)),
+            read_filter (
+                msg = "Filtering out zero length reads",
+                name = "zero_len",
+                label = "Zero length reads discarded",
+                func = lambda df, mask: df["read_len"] > 0)]
 
-        return d
+        # Filter out reads with duplicated read_id
+        if self.filter_duplicated:
+            filter_list.append (read_filter (
+                msg = "Filtering out duplicated reads",
+                name = "duplicated reads",
+                label = "Duplicated reads discarded",
+                func = first_read_id_mask if read_key_set is None else partial(first_read_key_mask, read_key_set=read_key_set)))
+
+        # Filter out calibration strand reads if the "calibration_strand_genome_template" field is available. Reads from files without
+        # the field have NA values and are kept
+        if self.filter_calibration and "calibration" in colnames:
+            filter_list.append (read_filter (
+                msg = "Filtering out calibration strand reads",
+                name = "calibration strand",
+                label = "Calibration reads discarded",
+                func = lambda df, mask: df["calibration"].isin(["filtered_out", "no_match", "*"])|df["calibration"].isna()))
+
+        # Filter based on runid_list list if passed by user
+        if self.runid_list:
+            filter_list.append (read_filter (
+                msg = "Selecting run_ids passed by user",
+                name = "run ID",
+                label = "Excluded runid reads discarded",
+                func = lambda df, mask: df["run_id"].isin(self.runid_list)))
+
+        return filter_list
+
+    def _get_read_filters (self, colnames, streaming=False):
+        """
+        List all the read filters in order of application as read_filter tuples.
+        In streaming mode only the filters which are not applied by chunks are listed
+        """
+        filter_list = [] if streaming else self._get_chunk_filters (colnames)
+
+        # User defined filters
+        filter_list.extend (self.extra_read_filters)
+
+        return filter_list
+
+    def _apply_read_filters (self, df, filter_list, chunk=False):
+        """
+        Apply a list of read_filter stages in a single pass. Each stage only contributes a boolean mask and the df is filtered once at the end.
+        Return the filtered df and a Counter of the reads discarded by each stage. Unless chunk is True, the stages are logged and an
+        error is raised if no valid read is left
+        """
+        mask = np.ones (len(df), dtype=bool)
+        counter = Counter()
+        for f in filter_list:
+            if not chunk:
+                self.logger.info ("\t{}".format(f.msg))
+            stage_mask = np.asarray (f.func(df, mask), dtype=bool)
+            n = int((mask & ~stage_mask).sum())
+            mask &= stage_mask
+            counter[f.label] = n
+            if not chunk:
+                self.logger.info ("\t\t{:,} reads discarded".format(n))
+                if mask.sum() <= 1:
+                    raise pycoQCError("No valid read left after {} filtering".format(f.name))
+
+        if not mask.all():
+            df = df[mask]
+        return (df, counter)
 
     def _select_df_columns(self, df, required_colnames, optional_colnames):
         """"""
@@ -400,3 +775,279 @@ class pycoQC_parse ():
                 col_found.append(col)
 
         return df[col_found]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~FUNCTIONS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+# Lookup tables of CIGAR operation codes (-1 for digits) and MD tag mismatched bases
+CIGAR_OP_CODES = np.full (256, -1, dtype=np.int8)
+for i, op in enumerate ("MIDNSHP=X"):
+    CIGAR_OP_CODES[ord(op)] = i
+MD_BASES = np.zeros (256, dtype=bool)
+for base in "ATCGatcg":
+    MD_BASES[ord(base)] = True
+
+class AlignmentStatsBuffer ():
+    """
+    Growable columnar buffer accumulating the statistics of primary alignments in preallocated typed arrays
+    """
+    dtype_dict = OrderedDict ((
+        ("ref_id", "int32"),
+        ("ref_start", "int64"),
+        ("ref_end", "int64"),
+        ("align_len", "uint32"),
+        ("mapq", "uint8"),
+        ("insertion", "uint32"),
+        ("deletion", "uint32"),
+        ("soft_clip", "uint32"),
+        ("mismatch", "int32"),
+        ("identity_freq", "float32"),
+        ("has_score", "bool")))
+
+    def __init__ (self, size=65536):
+        self.n = 0
+        self.read_id_list = []
+        self.array_dict = OrderedDict ((col, np.zeros(size, dtype=dtype)) for col, dtype in self.dtype_dict.items())
+
+    def __len__ (self):
+        return self.n
+
+    def append_block (self, read_id_list, col_dict):
+        """Append a block of alignments given as a list of read_ids and a dict of arrays for all dtype_dict columns"""
+        n = len(read_id_list)
+        while self.n+n > len(self.array_dict["has_score"]):
+            self._grow ()
+        for col, array in self.array_dict.items():
+            array[self.n:self.n+n] = col_dict[col]
+        self.read_id_list.extend (read_id_list)
+        self.n += n
+
+    def get_arrays (self):
+        """
+        Return a dict of copies of the filled part of the arrays, including the read_ids as an object array. Copies are returned so
+        that the results do not keep the whole preallocated arrays alive
+        """
+        d = OrderedDict ()
+        d["read_id"] = np.array (self.read_id_list, dtype=object)
+        for col, array in self.array_dict.items():
+            d[col] = array[:self.n].copy()
+        return d
+
+    def _grow (self):
+        """Double the size of all the arrays"""
+        for col, array in self.array_dict.items():
+            new_array = np.zeros (len(array)*2, dtype=array.dtype)
+            new_array[:self.n] = array[:self.n]
+            self.array_dict[col] = new_array
+
+def first_read_id_mask (df, mask):
+    """
+    Return a boolean array flagging the first occurrence of each read_id among the reads retained in mask, and the reads not in mask
+    """
+    keep = np.ones (len(df), dtype=bool)
+    keep[mask] = ~df["read_id"][mask].duplicated(keep="first").values
+    return keep
+
+def first_read_key_mask (df, mask, read_key_set):
+    """
+    Return a boolean array flagging the first occurrence of each read among the reads retained in mask and the reads of read_key_set,
+    and the reads not in mask. Reads are compared through their compact keys, which are added to read_key_set
+    """
+    keep = np.ones (len(df), dtype=bool)
+    keep[mask] = read_key_set.first_mask (df["read_key_hi"].values[mask], df["read_key_lo"].values[mask])
+    return keep
+
+def get_bam_regions (bam, n_regions=1, reads_per_region=None, n_selected=None, rng=None):
+    """
+    List the regions of an open indexed BAM file containing mapped reads as (bam_fn, ref_id, start, end) tuples.
+    References are split in regions of similar size such that the total number of regions is close to n_regions
+    * bam
+        pysam AlignmentFile opened on an indexed BAM file
+    * n_regions
+        Approximative number of regions to generate
+    * reads_per_region
+        If given, each reference is instead split according to its number of mapped reads in the index, such that the regions
+        contain about reads_per_region mapped reads on average
+    * n_selected
+        If given, only return n_selected regions randomly selected with the same probability, in file order. The other regions
+        are never generated, so their number can be very large
+    * rng
+        numpy RandomState used to select the regions
+    """
+    # Only consider references with mapped reads
+    ref_list = []
+    for stat in bam.get_index_statistics():
+        if stat.total:
+            ref_list.append ((stat.contig, bam.get_reference_length(stat.contig), stat.mapped))
+
+    region_list = []
+    if ref_list:
+        if reads_per_region:
+            region_size_list = [max (int(np.ceil(ref_len*reads_per_region/max(mapped, 1))), 1) for ref_id, ref_len, mapped in ref_list]
+        else:
+            region_size = max (int(np.ceil(sum(ref_len for ref_id, ref_len, mapped in ref_list)/n_regions)), 1)
+            region_size_list = [region_size]*len(ref_list)
+        n_windows_list = [int(np.ceil(ref_len/region_size)) for (ref_id, ref_len, mapped), region_size in zip (ref_list, region_size_list)]
+        n_windows = sum (n_windows_list)
+        if n_selected is None:
+            window_idx = np.arange (n_windows)
+        else:
+            window_idx = np.sort (rng.choice (n_windows, min(n_selected, n_windows), replace=False))
+
+        # Find the reference and start of each window from its global index
+        offsets = np.cumsum ([0]+n_windows_list)
+        for i, ref_i in zip (window_idx, np.searchsorted (offsets, window_idx, side="right")-1):
+            ref_id, ref_len, mapped = ref_list[ref_i]
+            region_size = region_size_list[ref_i]
+            start = int(i-offsets[ref_i])*region_size
+            region_list.append ((bam.filename.decode(), ref_id, start, min(start+region_size, ref_len)))
+
+    return region_list
+
+def parse_bam_regions (region_list, bam_threads=1, block_size=10000):
+    """
+    Parse the alignments starting in a list of regions of the same indexed BAM file, opened only once.
+    Return a Counter of secondary and supplementary alignments and a dict of typed arrays with the statistics of primary alignments,
+    in region and file order. The ref_id array contains the reference index in the BAM header. Unmapped reads are skipped.
+    * region_list
+        List of (bam_fn, ref_id, start, end) tuples as generated by get_bam_regions, with the same bam_fn
+    * bam_threads
+        Number of htslib threads used to decompress the BAM file
+    * block_size
+        Number of primary alignments collected before computing their statistics with get_alignment_block_stats
+    """
+    alignments_dict = Counter()
+    buffer = AlignmentStatsBuffer ()
+    block = AlignmentBlock ()
+
+    with ps.AlignmentFile(region_list[0][0], "rb", threads=bam_threads) as bam:
+        for bam_fn, ref_id, start, end in region_list:
+            for read in bam.fetch (ref_id, start, end):
+                # Skip reads overlapping the region but starting in the previous one
+                if start and read.reference_start < start:
+                    continue
+                # Fast path for non-primary records using the flag only (unmapped 0x4, secondary 0x100, supplementary 0x800)
+                flag = read.flag
+                if flag & 0x904:
+                    if flag & 0x4:
+                        continue
+                    elif flag & 0x100:
+                        alignments_dict["Secondary"]+=1
+                    else:
+                        alignments_dict["Suplementary"]+=1
+                else:
+                    block.append (read)
+                    if len(block) == block_size:
+                        buffer.append_block (block.read_id, block.get_stats())
+                        block = AlignmentBlock ()
+
+    if len(block):
+        buffer.append_block (block.read_id, block.get_stats())
+
+    return (alignments_dict, buffer.get_arrays())
+
+class AlignmentBlock ():
+    """
+    Block of primary alignments for which only the raw fields are collected. The statistics are computed for the whole block at once
+    """
+    def __init__ (self):
+        self.read_id = []
+        self.ref_id = []
+        self.ref_start = []
+        self.ref_end = []
+        self.mapq = []
+        self.cigar = []
+        self.md = []
+        self.nm = []
+
+    def __len__ (self):
+        return len(self.read_id)
+
+    def append (self, read):
+        """Collect the raw fields of a pysam AlignedSegment. The MD tag is only extracted if the NM tag is not available"""
+        self.read_id.append (read.query_name)
+        self.ref_id.append (read.reference_id)
+        self.ref_start.append (read.reference_start)
+        self.ref_end.append (read.reference_end)
+        self.mapq.append (read.mapping_quality)
+        self.cigar.append (read.cigarstring or "")
+        if read.has_tag("NM"):
+            self.nm.append (read.get_tag("NM"))
+            self.md.append ("")
+        else:
+            self.nm.append (-1)
+            self.md.append (read.get_tag("MD") if read.has_tag("MD") else "")
+
+    def get_stats (self):
+        """Return a dict of arrays with the statistics of all the alignments in the block"""
+        d = OrderedDict ()
+        d["ref_id"] = self.ref_id
+        d["ref_start"] = self.ref_start
+        d["ref_end"] = self.ref_end
+        d["mapq"] = self.mapq
+        d.update (get_alignment_block_stats (self.cigar, self.md, self.nm))
+        return d
+
+def str_list_to_char_array (str_list):
+    """
+    Concatenate a list of ASCII strings in a single uint8 array.
+    Return the array and the index of the string of origin of each character
+    """
+    str_len = np.fromiter ((len(s) for s in str_list), dtype=np.int64, count=len(str_list))
+    char_array = np.frombuffer ("".join(str_list).encode("ascii"), dtype=np.uint8)
+    str_idx = np.repeat (np.arange(len(str_list)), str_len)
+    return (char_array, str_idx)
+
+def get_alignment_block_stats (cigar_list, md_list, nm_list):
+    """
+    Compute the alignment statistics of a block of alignments with vectorised operations on the concatenated CIGAR and MD strings.
+    Return a dict of arrays with the aligned length, insertion, deletion, soft_clip, mismatch and identity_freq of each alignment,
+    and a has_score mask indicating if the mismatch and identity could be computed (NM or MD tag available)
+    * cigar_list
+        List of CIGAR strings
+    * md_list
+        List of MD tags. Empty strings if not available
+    * nm_list
+        List of NM tags values. -1 if not available
+    """
+    n = len(cigar_list)
+
+    # Find the operations in the concatenated CIGAR strings. Each digit belongs to the next operation
+    char_array, str_idx = str_list_to_char_array (cigar_list)
+    code_array = CIGAR_OP_CODES[char_array]
+    op_pos = np.flatnonzero (code_array >= 0)
+    digit_pos = np.flatnonzero (code_array < 0)
+    digit_op = np.searchsorted (op_pos, digit_pos)
+
+    # Decode operation lengths by summing the digits weighted by their decimal position
+    digit_val = (char_array[digit_pos]-48) * 10.0**(op_pos[digit_op]-digit_pos-1)
+    op_len = np.bincount (digit_op, weights=digit_val, minlength=len(op_pos))
+
+    # Sum operation lengths per alignment and per operation type, similar to pysam get_cigar_stats
+    cigar_stats = np.bincount (str_idx[op_pos]*9+code_array[op_pos], weights=op_len, minlength=n*9).reshape (n, 9)
+    insertion = cigar_stats[:,1]
+    deletion = cigar_stats[:,2]
+    soft_clip = cigar_stats[:,4]
+    align_len = cigar_stats[:,0]+cigar_stats[:,1]+cigar_stats[:,7]+cigar_stats[:,8]
+
+    # Count mismatched (and deleted) bases in MD tags
+    char_array, str_idx = str_list_to_char_array (md_list)
+    md_err = np.bincount (str_idx[MD_BASES[char_array]], minlength=n)
+
+    # Compute alignment score from NM field if available, else from MD field
+    nm = np.asarray (nm_list, dtype=np.int64)
+    has_nm = nm >= 0
+    has_md = np.fromiter ((len(md) > 0 for md in md_list), dtype=bool, count=n)
+    mismatch = np.where (has_nm, nm-(deletion+insertion), md_err-deletion)
+    edit_dist = np.where (has_nm, nm, mismatch+insertion+deletion)
+    with np.errstate (divide="ignore", invalid="ignore"):
+        identity_freq = np.where (align_len > 0, (align_len-edit_dist)/align_len, 0)
+
+    d = OrderedDict ()
+    d["align_len"] = align_len
+    d["insertion"] = insertion
+    d["deletion"] = deletion
+    d["soft_clip"] = soft_clip
+    d["mismatch"] = mismatch
+    d["identity_freq"] = identity_freq
+    d["has_score"] = has_nm|has_md
+    return d
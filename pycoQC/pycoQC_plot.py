@@ -31,11 +31,18 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~MAIN CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class pycoQC_plot ():
 
+    # Number of reads processed at once when streaming over the full data
+    chunksize = 1000000
+
+    # Maximal number of prepared plot data kept in the LRU cache of the __*_data methods
+    data_cache_size = 64
+
     def __init__ (self,
         parser:pycoQC_parse,
         min_pass_qual:int=7,
         min_pass_len:int=0,
-        sample:int=100000,
+        sample:int=None,
+        quantile_error:float=None,
         verbose:bool=False,
         quiet:bool=False):
         """
@@ -46,7 +53,12 @@ class pycoQC_plot ():
         * min_pass_len
             Minimum read length to consider a read as 'pass'
         * sample
-            If not None a n number of reads will be randomly selected instead of the entire dataset for plotting function (deterministic sampling)
+            Deprecated and ignored. All the plots and statistics are computed from the full data
+        * quantile_error
+            If given, percentiles and medians are estimated from mergeable quantile sketches with this approximative rank error. The
+            sketches filled by the parser are used if it was created with the same quantile_error, min_pass_qual and min_pass_len,
+            else they are filled in the same pass as the read counts. By default they are computed exactly from the full data, sorting
+            each field once
         """
 
         # Set logging level
@@ -55,7 +67,10 @@ class pycoQC_plot ():
 
         # Save args to self values
         self.min_pass_qual = min_pass_qual
-        self.sample = sample
+        self.min_pass_len = min_pass_len
+        self.quantile_error = quantile_error
+        if sample is not None:
+            warnings.warn ("The sample option is deprecated and ignored, all the reads are used", pycoQCWarning)
 
         # Check that parser is a valid instance of pycoQC_parse
         if not isinstance(parser, pycoQC_parse):
@@ -67,24 +82,11 @@ class pycoQC_plot ():
         if self.has_alignment:
             self.ref_len_dict = parser.ref_len_dict
             self.alignments_df = parser.alignments_df
+            self.alignment_scaling_factor = parser.bam_scaling_factor
         self.logger.info ("\tFound {:,} total reads".format(len(self.all_df)))
 
-        # Save df wiews and compute scaling factors
-        if sample and len(self.all_df)>sample:
-            self.all_sample_df = self.all_df.sample(n=sample, random_state=SEED)
-            self.all_scaling_factor = len(self.all_df)/sample
-        else:
-            self.all_sample_df = self.all_df
-            self.all_scaling_factor = 1
-
-        self.pass_df = self.all_df.query ("mean_qscore>={} and read_len>={}".format(min_pass_qual, min_pass_len))
-        if sample and len(self.pass_df)>sample:
-            self.pass_sample_df = self.pass_df.sample(n=sample, random_state=SEED)
-            self.pass_scaling_factor = len(self.pass_df)/sample
-        else:
-            self.pass_sample_df = self.pass_df
-            self.pass_scaling_factor = 1
-        self.logger.info ("\tFound {:,} pass reads (qual >= {} and length >= {})".format(len(self.pass_df), min_pass_qual, min_pass_len))
+        # Count pass reads, fill the sketches and reset the derived data caches
+        self.clear_cache ()
 
     def __str__(self):
         m = ""
@@ -93,16 +95,22 @@ class pycoQC_plot ():
         m+= "\tPromethion: {}\n".format(self.is_promethion)
         m+= "\tAll reads: {:,}\n".format(len(self.all_df))
         m+= "\tAll bases: {:,}\n".format(int(self.all_df["read_len"].sum()))
-        m+= "\tAll median read length: {:,}\n".format(np.median(self.all_df["read_len"]))
-        m+= "\tPass reads: {:,}\n".format(len(self.pass_df))
+        m+= "\tAll median read length: {:,}\n".format(self._compute_quantiles("all", "read_len", 0.5))
+        m+= "\tPass reads: {:,}\n".format(self.pass_count)
         m+= "\tPass bases: {:,}\n".format(int(self.pass_df["read_len"].sum()))
-        m+= "\tPass median read length: {:,}\n".format(np.median(self.pass_df["read_len"]))
+        m+= "\tPass median read length: {:,}\n".format(self._compute_quantiles("pass", "read_len", 0.5))
         return m
 
     def __repr__(self):
         return "[{}]\n".format(self.__class__.__name__)
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PROPERTY METHODS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    @property
+    def pass_df (self):
+        if self._pass_df is None:
+            self._pass_df = self.all_df[self._pass_mask(self.all_df)]
+        return self._pass_df
+
     @property
     def has_barcodes (self):
         return "barcode" in self.all_df
@@ -124,59 +132,102 @@ class pycoQC_plot ():
         if self.has_alignment:
             return np.sum(list(self.ref_len_dict.values()))
 
-    def _run_duration(self, df):
+    def _get_df (self, df_level):
+        """Return the full df of all reads, pass reads or reads with a given barcode"""
+        if df_level == "all":
+            return self.all_df
+        elif df_level == "pass":
+            return self.pass_df
+        if not df_level in self._barcode_df_dict:
+            self._barcode_df_dict[df_level] = self.all_df[self.all_df["barcode"]==df_level]
+        return self._barcode_df_dict[df_level]
+
+    def _pass_mask (self, df):
+        return ((df["mean_qscore"]>=self.min_pass_qual) & (df["read_len"]>=self.min_pass_len)).values
+
+    def _iter_df_chunks (self, df_level, field_names):
+        """Iterate over the full data of all or pass reads by chunks, with only the given fields"""
+        for start in range (0, len(self.all_df), self.chunksize):
+            chunk_df = self.all_df.iloc[start:start+self.chunksize]
+            if df_level == "pass":
+                chunk_df = chunk_df[self._pass_mask(chunk_df)]
+            yield chunk_df[field_names]
+
+    def _fields_range (self, df_level, field_names):
+        """Return the list of (min, max) values of the given fields over the full data, for reads without NA values in any of the fields"""
+        min_list = []
+        max_list = []
+        for df in self._iter_df_chunks (df_level, field_names):
+            df = df.dropna()
+            if not df.empty:
+                min_list.append (df.min().values)
+                max_list.append (df.max().values)
+        return list(zip (np.min(min_list, axis=0), np.max(max_list, axis=0)))
+
+    def _run_duration(self, df_level):
+        df = self._get_df(df_level)
         return float(np.ptp(df["start_time"])/3600)
 
-    def _active_channels(self, df):
-        return int(df["channel"].nunique())
+    def _active_channels(self, df_level):
+        return len(self._metric_cube().reduce(["channel"], **self._cube_filters(df_level))["channel"])
 
-    def _runid_number(self, df):
-        return int(df["run_id"].nunique())
+    def _runid_number(self, df_level):
+        cells = self._metric_cube().reduce(["run_id"], **self._cube_filters(df_level))
+        return int((cells["run_id"]>0).sum())
 
-    def _barcodes_number(self, df):
-        return int(df["barcode"].nunique()) if self.has_barcodes else 0
+    def _barcodes_number(self, df_level):
+        if not self.has_barcodes:
+            return 0
+        cells = self._metric_cube().reduce(["barcode"], **self._cube_filters(df_level))
+        return int((cells["barcode"]>0).sum())
 
-    def _basecalled_reads(self, df):
-        return len(df)
+    def _basecalled_reads(self, df_level):
+        return self._metric_cube().reduce([], **self._cube_filters(df_level))["reads"]
 
-    def _basecalled_bases(self, df):
-        return int(df["read_len"].sum())
+    def _basecalled_bases(self, df_level):
+        return self._metric_cube().reduce([], **self._cube_filters(df_level))["bases"]
 
-    def _basecall_N50(self, df):
-        return self._compute_N50(df["read_len"])
+    def _basecall_N50(self, df_level):
+        return self._compute_Nxx(df_level, "read_len", 50)[0]
 
-    def _basecall_median_read_len(self, df):
-        return np.median(df["read_len"])
+    def _basecall_median_read_len(self, df_level):
+        return self._compute_quantiles(df_level, "read_len", 0.5)
 
-    def _basecall_median_read_qscore(self, df):
-        return np.median(df["mean_qscore"])
+    def _basecall_median_read_qscore(self, df_level):
+        return self._compute_quantiles(df_level, "mean_qscore", 0.5)
 
-    def _alignment_mean_coverage(self, df):
-        return df["align_len"].dropna().sum()/self.total_ref_len if self.has_alignment else np.nan
+    def _alignment_mean_coverage(self, df_level):
+        df = self._get_df(df_level)
+        return df["align_len"].dropna().sum()*self.alignment_scaling_factor/self.total_ref_len if self.has_alignment else np.nan
 
-    def _aligned_reads(self, df):
-        return len(df["align_len"].dropna()) if self.has_alignment else np.nan
+    def _aligned_reads(self, df_level):
+        df = self._get_df(df_level)
+        return int(round(len(df["align_len"].dropna())*self.alignment_scaling_factor)) if self.has_alignment else np.nan
 
-    def _aligned_bases(self, df):
-        return int(df["align_len"].dropna().sum()) if self.has_alignment else np.nan
+    def _aligned_bases(self, df_level):
+        df = self._get_df(df_level)
+        return int(round(df["align_len"].dropna().sum()*self.alignment_scaling_factor)) if self.has_alignment else np.nan
 
-    def _alignment_N50(self, df):
-        return self._compute_N50(df["align_len"]) if self.has_alignment else np.nan
+    def _alignment_N50(self, df_level):
+        return self._compute_Nxx(df_level, "align_len", 50)[0] if self.has_alignment else np.nan
 
-    def _alignment_median_read_len(self, df):
-        return np.median(df["align_len"].dropna()) if self.has_alignment else np.nan
+    def _alignment_median_read_len(self, df_level):
+        return self._compute_quantiles(df_level, "align_len", 0.5) if self.has_alignment else np.nan
 
-    def _alignment_median_identity(self, df):
-        return np.median(df["identity_freq"].dropna()) if self.has_identity_freq else np.nan
+    def _alignment_median_identity(self, df_level):
+        return self._compute_quantiles(df_level, "identity_freq", 0.5) if self.has_identity_freq else np.nan
 
-    def _alignment_insertion_rate(self, df):
-        return df["insertion"].dropna().sum()/self._aligned_bases(df) if self.has_identity_freq else np.nan
+    def _alignment_insertion_rate(self, df_level):
+        df = self._get_df(df_level)
+        return df["insertion"].dropna().sum()*self.alignment_scaling_factor/self._aligned_bases(df_level) if self.has_identity_freq else np.nan
 
-    def _alignment_deletion_rate(self, df):
-        return df["deletion"].dropna().sum()/self._aligned_bases(df) if self.has_identity_freq else np.nan
+    def _alignment_deletion_rate(self, df_level):
+        df = self._get_df(df_level)
+        return df["deletion"].dropna().sum()*self.alignment_scaling_factor/self._aligned_bases(df_level) if self.has_identity_freq else np.nan
 
-    def _alignment_mismatch_rate(self, df):
-        return df["mismatch"].dropna().sum()/self._aligned_bases(df) if self.has_identity_freq else np.nan
+    def _alignment_mismatch_rate(self, df_level):
+        df = self._get_df(df_level)
+        return df["mismatch"].dropna().sum()*self.alignment_scaling_factor/self._aligned_bases(df_level) if self.has_identity_freq else np.nan
 
     #~~~~~~~SUMMARY_STATS_DICT METHOD AND HELPER~~~~~~~#
 
@@ -191,24 +242,25 @@ class pycoQC_plot ():
         d["pycoqc"]["version"] = package_version
         d["pycoqc"]["date"] = datetime.datetime.now().strftime("%d/%m/%y")
 
-        for df, lab in ((self.all_df, "All Reads"), (self.pass_df, "Pass Reads")):
-            d[lab] = self._compute_stats(df)
+        for df_level, lab in (("all", "All Reads"), ("pass", "Pass Reads")):
+            d[lab] = self._compute_stats(df_level)
         return d
 
-    def _compute_stats (self, df):
+    def _compute_stats (self, df_level):
+        df = self._get_df(df_level)
         d = OrderedDict ()
         # run information
         d["run"] = OrderedDict()
-        d["run"]["run_duration"] = self._run_duration(df)
-        d["run"]["active_channels"] = self._active_channels(df)
-        d["run"]["runid_number"] = self._runid_number(df)
-        d["run"]["barcodes_number"] = self._barcodes_number(df)
+        d["run"]["run_duration"] = self._run_duration(df_level)
+        d["run"]["active_channels"] = self._active_channels(df_level)
+        d["run"]["runid_number"] = self._runid_number(df_level)
+        d["run"]["barcodes_number"] = self._barcodes_number(df_level)
         d["basecall"] = OrderedDict()
-        d["basecall"]["reads_number"] = self._basecalled_reads(df)
-        d["basecall"]["bases_number"] = self._basecalled_bases(df)
-        d["basecall"]["N50"] = self._basecall_N50(df)
-        d["basecall"]["len_percentiles"] = self._compute_percentiles (df["read_len"])
-        d["basecall"]["qual_score_percentiles"] = self._compute_percentiles (df["mean_qscore"])
+        d["basecall"]["reads_number"] = self._basecalled_reads(df_level)
+        d["basecall"]["bases_number"] = self._basecalled_bases(df_level)
+        d["basecall"]["N50"] = self._basecall_N50(df_level)
+        d["basecall"]["len_percentiles"] = self._compute_percentiles (df_level, "read_len")
+        d["basecall"]["qual_score_percentiles"] = self._compute_percentiles (df_level, "mean_qscore")
 
         x,y = self._compute_hist(data=df["read_len"],x_scale="log",smooth_sigma=2,nbins=100)
         d["basecall"]["len_hist"] = OrderedDict ()
@@ -221,21 +273,21 @@ class pycoQC_plot ():
 
         if self.has_alignment:
             d["alignment"] = OrderedDict()
-            d["alignment"]["reads_number"] = self._aligned_reads(df)
-            d["alignment"]["bases_number"] = self._aligned_bases(df)
-            d["alignment"]["mean_coverage"] = self._alignment_mean_coverage(df)
-            d["alignment"]["N50"] = self._alignment_N50(df)
-            d["alignment"]["len_percentiles"] = self._compute_percentiles (df["align_len"])
+            d["alignment"]["reads_number"] = self._aligned_reads(df_level)
+            d["alignment"]["bases_number"] = self._aligned_bases(df_level)
+            d["alignment"]["mean_coverage"] = self._alignment_mean_coverage(df_level)
+            d["alignment"]["N50"] = self._alignment_N50(df_level)
+            d["alignment"]["len_percentiles"] = self._compute_percentiles (df_level, "align_len")
             x,y = self._compute_hist(data=df["align_len"],x_scale="log",smooth_sigma=2,nbins=100)
             d["alignment"]["len_hist"] = OrderedDict ()
             d["alignment"]["len_hist"]["x"] = x
             d["alignment"]["len_hist"]["y"] = y
 
             if self.has_identity_freq:
-                d["alignment"]["identity_freq_percentiles"] = self._compute_percentiles (df["identity_freq"])
-                d["alignment"]["insertion_rate"] = self._alignment_insertion_rate(df)
-                d["alignment"]["deletion_rate"] = self._alignment_deletion_rate(df)
-                d["alignment"]["mismatch_rate"] = self._alignment_mismatch_rate(df)
+                d["alignment"]["identity_freq_percentiles"] = self._compute_percentiles (df_level, "identity_freq")
+                d["alignment"]["insertion_rate"] = self._alignment_insertion_rate(df_level)
+                d["alignment"]["deletion_rate"] = self._alignment_deletion_rate(df_level)
+                d["alignment"]["mismatch_rate"] = self._alignment_mismatch_rate(df_level)
                 x,y = self._compute_hist(data=df["identity_freq"],x_scale="linear",smooth_sigma=2,nbins=100)
                 d["alignment"]["identity_freq_hist"] = OrderedDict ()
                 d["alignment"]["identity_freq_hist"]["x"] = x
@@ -262,13 +314,13 @@ class pycoQC_plot ():
         """
         # Extract data
         data = []
-        for status, df in (("All Reads", self.all_df), ("Pass Reads", self.pass_df)):
+        for status, df_level in (("All Reads", "all"), ("Pass Reads", "pass")):
             data.append([
                 status,
-                self._run_duration(df),
-                self._active_channels(df),
-                self._runid_number(df),
-                self._barcodes_number(df)])
+                self._run_duration(df_level),
+                self._active_channels(df_level),
+                self._runid_number(df_level),
+                self._barcodes_number(df_level)])
 
         fig = self.__summary_plot (
             width = width,
@@ -297,14 +349,14 @@ class pycoQC_plot ():
         """
         # Extract data
         data = []
-        for status, df in (("All Reads", self.all_df), ("Pass Reads", self.pass_df)):
+        for status, df_level in (("All Reads", "all"), ("Pass Reads", "pass")):
             data.append([
                 status,
-                self._basecalled_reads(df),
-                self._basecalled_bases(df),
-                self._basecall_N50(df),
-                self._basecall_median_read_len(df),
-                self._basecall_median_read_qscore(df)])
+                self._basecalled_reads(df_level),
+                self._basecalled_bases(df_level),
+                self._basecall_N50(df_level),
+                self._basecall_median_read_len(df_level),
+                self._basecall_median_read_qscore(df_level)])
 
         fig = self.__summary_plot (
             width = width,
@@ -336,15 +388,15 @@ class pycoQC_plot ():
             raise pycoQCError ("No Alignment information available")
 
         data = []
-        for status, df in (("All Reads", self.all_df), ("Pass Reads", self.pass_df)):
+        for status, df_level in (("All Reads", "all"), ("Pass Reads", "pass")):
             data.append([
                 status,
-                self._aligned_reads(df),
-                self._aligned_bases(df),
-                self._alignment_mean_coverage(df),
-                self._alignment_N50(df),
-                self._alignment_median_read_len(df),
-                self._alignment_median_identity(df)])
+                self._aligned_reads(df_level),
+                self._aligned_bases(df_level),
+                self._alignment_mean_coverage(df_level),
+                self._alignment_N50(df_level),
+                self._alignment_median_read_len(df_level),
+                self._alignment_median_identity(df_level)])
 
         fig = self.__summary_plot (
             width = width,
@@ -569,32 +621,28 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
+    @memoize_data
     def __1D_density_data (self, df_level, field_name, x_scale, nbins, smooth_sigma):
         """Private function preparing data for reads_1D"""
 
         self.logger.debug ("\t\tPreparing data for {} reads and {}".format(df_level, field_name))
 
-        # Get data
-        df = self.pass_sample_df if df_level=="pass" else self.all_sample_df
-        data = df[field_name].dropna().values
-
-        # Count each categories in log or linear space
-        min = np.nanmin(data)
-        max = np.nanmax(data)
-        if x_scale == "log":
-            count_y, bins = np.histogram (a=data, bins=np.logspace (np.log10(min), np.log10(max)+0.1, nbins))
-        elif x_scale == "linear":
-            count_y, bins = np.histogram (a=data, bins= np.linspace (min, max, nbins))
+        # Count each categories in log or linear space over the full data
+        (min, max), = self._fields_range (df_level, [field_name])
+        hist = Hist1D.from_range (min, max, nbins, scale=x_scale)
+        for df in self._iter_df_chunks (df_level, [field_name]):
+            hist.update (df[field_name].values)
+        count_y = hist.counts
 
         # Remove last bin from labels
-        count_x = bins[1:]
+        count_x = hist.bins[1:]
 
         # Smooth results with a gaussian filter
         if smooth_sigma:
             count_y = gaussian_filter1d (count_y, sigma=smooth_sigma)
 
         # Get percentiles percentiles
-        stat = np.percentile (data, [10,25,50,75,90])
+        stat = self._compute_quantiles (df_level, field_name, [0.1,0.25,0.5,0.75,0.9])
         y_max = count_y.max()
 
         data_dict = dict (
@@ -851,33 +899,32 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
+    @memoize_data
     def __2D_density_data (self, df_level, x_field_name, y_field_name, x_nbins, y_nbins, x_scale, y_scale, smooth_sigma):
         """ Private function preparing data for 2D_density_plot """
 
         self.logger.debug ("\t\tPreparing data for {} reads".format(df_level))
 
-        # Extract data field from df
-        df = self.pass_sample_df if df_level == "pass" else self.all_sample_df
-        df = df[[x_field_name, y_field_name]].dropna()
-
-        # Prepare data for x
-        x_data = df[x_field_name].values
-        x_min, x_med, x_max = np.percentile (x_data, (0, 50, 100))
-        if x_scale == "log":
-            x_bins = np.logspace (start=np.log10((x_min)), stop=np.log10(x_max)+0.1, num=x_nbins, base=10)
+        # Define bins from the range of the full data
+        (x_min, x_max), (y_min, y_max) = self._fields_range (df_level, [x_field_name, y_field_name])
+        x_bins = Hist1D.from_range (x_min, x_max, x_nbins, scale=x_scale).bins
+        y_bins = Hist1D.from_range (y_min, y_max, y_nbins, scale=y_scale).bins
+
+        # Compute 2D histogram over the full data
+        hist = Hist2D (x_bins=y_bins, y_bins=x_bins)
+        has_na = False
+        for df in self._iter_df_chunks (df_level, [x_field_name, y_field_name]):
+            hist.update (df[y_field_name].values, df[x_field_name].values)
+            has_na = has_na or df.isna().values.any()
+        z, y, x = hist.counts.astype(np.float64), y_bins, x_bins
+
+        # Get medians of the reads in the histogram, as for all the other plots and summaries if no read has a NA value
+        if has_na:
+            x_med, y_med = self._paired_quantiles (df_level, [x_field_name, y_field_name], 0.5)
         else:
-            x_bins = np.linspace (start=x_min, stop=x_max, num=x_nbins)
+            x_med = self._compute_quantiles (df_level, x_field_name, 0.5)
+            y_med = self._compute_quantiles (df_level, y_field_name, 0.5)
 
-        # Prepare data for y
-        y_data = df[y_field_name].values
-        y_min, y_med, y_max = np.percentile (y_data, (0, 50, 100))
-        if y_scale == "log":
-            y_bins = np.logspace (start=np.log10((y_min)), stop=np.log10(y_max)+0.1, num=y_nbins, base=10)
-        else:
-            y_bins = np.linspace (start=y_min, stop=y_max, num=y_nbins)
-
-        # Compute 2D histogram
-        z, y, x = np.histogram2d (x=y_data, y=x_data, bins=[y_bins, x_bins])
         if smooth_sigma:
             z = gaussian_filter(z, sigma=smooth_sigma)
         z_min, z_max = np.percentile (z, (0, 100))
@@ -957,27 +1004,16 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
+    @memoize_data
     def __output_over_time_data (self, df_level, count_level, time_bins=500):
         """Private function preparing data for output_over_time"""
         self.logger.debug ("\t\tPreparing data for {} {}".format(df_level, count_level))
 
-        # Get data and scaling factor
-        df = self.pass_sample_df if df_level == "pass" else self.all_sample_df
-        sf = self.pass_scaling_factor if df_level == "pass" else self.all_scaling_factor
-
-        # Bin data in categories
-        t = (df["start_time"]/3600).values
-        x = np.linspace (t.min(), t.max(), num=time_bins)
-        t = np.digitize (t, bins=x, right=True)
-
-        # Count reads or bases per categories
-        if count_level == "reads":
-            y = np.bincount(t)
-        elif count_level == "bases":
-            y = np.bincount(t, weights=df["read_len"].values)
-
-        # Scale counts in case of downsampling
-        y = y*sf
+        # Count reads or bases per time bins from the metric cube. All and pass reads share the time axis of all reads
+        x = self._time_bins ("all", time_bins)[0]
+        cells = self._metric_cube(time_bins).reduce (["time_bin"], **self._cube_filters(df_level))
+        y = np.zeros (len(x), dtype=np.int64 if count_level == "reads" else np.float64)
+        y[cells["time_bin"]] = cells[count_level]
 
         # Transform to cummulative distribution
         y_cum = np.cumsum(y)
@@ -1240,35 +1276,19 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
+    @memoize_data
     def __over_time_data (self, df_level, field_name="read_len", smooth_sigma=1.5, time_bins=500):
         """Private function preparing data for qual_over_time"""
         self.logger.debug ("\t\tPreparing data for {} reads and {}".format(df_level, field_name))
 
-        # get data
-        df = self.pass_sample_df if df_level == "pass" else self.all_sample_df
-        data = df[field_name].dropna().values
-
-        # Bin data in categories
-        t = (df["start_time"]/3600).values
-        x = np.linspace (t.min(), t.max(), num=time_bins)
-        t = np.digitize (t, bins=x, right=True)
-
-        # List quality value per categories
-        bin_dict = defaultdict (list)
-        for bin_idx, val in zip (t, data) :
-            bin = x[bin_idx]
-            bin_dict[bin].append(val)
+        # get data and cached time bins
+        data = self._get_df(df_level)[field_name].values
+        x, t = self._time_bins (df_level, time_bins)
 
         # Aggregate values per category
         val_name = ["Min", "Max", "25%", "75%", "Median"]
-        stat_dict = defaultdict(list)
-        for bin in x:
-            if bin in bin_dict:
-                p = np.percentile (bin_dict[bin], [0, 100, 25, 75, 50])
-            else:
-                p = [np.nan,np.nan,np.nan,np.nan,np.nan]
-            for val, stat in zip (val_name, p):
-                stat_dict[val].append(stat)
+        p = grouped_quantiles (group_idx=t, values=data, n_groups=len(x), q=[0, 1, 0.25, 0.75, 0.5])
+        stat_dict = {val:p[:,i] for i, val in enumerate(val_name)}
 
         # Values smoothing
         if smooth_sigma:
@@ -1330,13 +1350,15 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
+    @memoize_data
     def __barcode_counts_data (self, df_level):
         """Private function preparing data for barcode_counts"""
         self.logger.debug ("\t\tPreparing data for {} reads".format(df_level))
 
-        # get data
-        df = self.pass_df if df_level == "pass" else self.all_df
-        counts = df["barcode"].value_counts()
+        # get counts from the metric cube
+        cells = self._metric_cube().reduce (["barcode"], **self._cube_filters(df_level))
+        valid = cells["barcode"] > 0
+        counts = pd.Series (cells["reads"][valid], index=self.all_df["barcode"].cat.categories[cells["barcode"][valid]-1].astype(str))
         counts = counts.sort_index()
 
         # Extract label and values
@@ -1378,14 +1400,8 @@ class pycoQC_plot ():
         """
         self.logger.info ("\t\tComputing plot")
 
-        # Define maximal number of channels
-        n_channels = 3000 if self.is_promethion else 512
-
         # Prepare all data
-        lab1, dd1 = self.__channels_activity_data(df_level="all", count_level="reads", n_channels=n_channels, smooth_sigma=smooth_sigma, time_bins=time_bins)
-        lab2, dd2 = self.__channels_activity_data(df_level="pass", count_level="reads", n_channels=n_channels, smooth_sigma=smooth_sigma, time_bins=time_bins)
-        lab3, dd3 = self.__channels_activity_data(df_level="all", count_level="bases", n_channels=n_channels, smooth_sigma=smooth_sigma, time_bins=time_bins)
-        lab4, dd4 = self.__channels_activity_data(df_level="pass", count_level="bases", n_channels=n_channels, smooth_sigma=smooth_sigma, time_bins=time_bins)
+        (lab1, dd1), (lab2, dd2), (lab3, dd3), (lab4, dd4) = self.__channels_activity_data(smooth_sigma=smooth_sigma, time_bins=time_bins)
 
         # Plot initial data
         data = [go.Heatmap(x=dd1["x"][0], y=dd1["y"][0], z=dd1["z"][0], xgap=0.5, colorscale=colorscale, hoverinfo="x+y+z")]
@@ -1410,47 +1426,50 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
-    def __channels_activity_data (self, df_level, count_level="bases", n_channels=512, smooth_sigma=2, time_bins=150):
-        """Private function preparing data for channels_activity"""
-        self.logger.debug ("\t\tPreparing data for {} {}".format(df_level, count_level))
-
-        # Get data and scaling factor
-        df = self.pass_sample_df if df_level == "pass" else self.all_sample_df
-        sf = self.pass_scaling_factor if df_level == "pass" else self.all_scaling_factor
-
-        # Bin data in categories
-        t = (df["start_time"]/3600).values
-        bins = np.linspace (t.min(), t.max(), num=time_bins)
-        t = np.digitize (t, bins=bins, right=True)
-
-        # Count values per categories
-        z = np.ones((len(bins), n_channels), dtype=np.int)
-        if count_level == "bases":
-            for t_idx, channel, n_bases in zip(t, df["channel"], df["read_len"]):
-                z[t_idx][channel-1]+=n_bases
-        elif count_level == "reads":
-            for t_idx, channel in zip(t, df["channel"]):
-                try:
-                    z[t_idx][channel-1]+=1
-                except IndexError:
-                    print (t_idx, channel)
-                    raise
-        # Scale counts in case of downsampling
-        z=z*sf
-
-        # Time series smoothing
-        if smooth_sigma:
-            z = gaussian_filter1d (z.astype(np.float32), sigma=smooth_sigma, axis=0)
+    @memoize_data
+    def __channels_activity_data (self, smooth_sigma=2, time_bins=150):
+        """
+        Private function preparing data for channels_activity. The reads and bases counts of all and pass reads are obtained
+        from the (time bin, channel, pass) cells of the metric cube with one linearised bincount over (level, time bin, channel)
+        """
+        self.logger.debug ("\t\tPreparing data for all and pass reads and bases")
+
+        # Define time bins and channel range
+        bins = self._time_bins ("all", time_bins)[0]
+        cells = self._metric_cube(time_bins).reduce (["time_bin", "channel", "pass"])
+        min_channel = int(cells["channel"].min())
+        max_channel = int(cells["channel"].max())
+        n_channels = max_channel-min_channel+1
+        n_cells = len(bins)*n_channels
+
+        # Count reads and bases per cells for all reads (first block) and pass reads (second block)
+        idx = cells["time_bin"].astype(np.int64)*n_channels + cells["channel"].astype(np.int64)-min_channel
+        pass_mask = cells["pass"] == 1
+        idx = np.concatenate ((idx, idx[pass_mask]+n_cells))
+        reads = cells["reads"]
+        bases = cells["bases"]
+        reads_count = np.bincount (idx, weights=np.concatenate((reads, reads[pass_mask])), minlength=2*n_cells).astype(np.int64)
+        bases_count = np.bincount (idx, weights=np.concatenate((bases, bases[pass_mask])), minlength=2*n_cells).astype(np.int64)
 
         # Define x and y axis
-        x = ["c {}".format(i) for i in range(1, n_channels+1)]
+        x = ["c {}".format(i) for i in range(min_channel, max_channel+1)]
         y = bins[1:]
 
-        # Make data dict
-        data_dict = dict (x=[x], y=[y], z=[z])
+        data_list = []
+        for count_level, counts in (("reads", reads_count), ("bases", bases_count)):
+            for level_idx, df_level in enumerate (("all", "pass")):
+                z = counts[level_idx*n_cells:(level_idx+1)*n_cells].reshape (len(bins), n_channels)+1
 
-        label = "{} {}".format(df_level.capitalize(), count_level.capitalize())
-        return (label, data_dict)
+                # Time series smoothing
+                if smooth_sigma:
+                    z = gaussian_filter1d (z.astype(np.float32), sigma=smooth_sigma, axis=0)
+
+                # Make data dict
+                data_dict = dict (x=[x], y=[y], z=[z])
+                label = "{} {}".format(df_level.capitalize(), count_level.capitalize())
+                data_list.append ((label, data_dict))
+
+        return data_list
 
     #~~~~~~~ALIGNMENT_SUMMARY METHOD~~~~~~~#
     def alignment_reads_status (self,
@@ -1528,7 +1547,13 @@ class pycoQC_plot ():
 
         # Extract Data
         bc_bases = self.all_df["read_len"].sum()
-        s = self.all_df[[ "read_len", "align_len", "insertion", "deletion", "soft_clip", "mismatch"]].dropna().sum()
+        # Sum columns one by one over the reads without missing values, selecting several columns would consolidate the data
+        field_list = ["read_len", "align_len", "insertion", "deletion", "soft_clip", "mismatch"]
+        valid = np.logical_and.reduce ([self.all_df[field].notna().values for field in field_list])
+        s = pd.Series ({field:self.all_df[field].values[valid].sum() for field in field_list})
+        # Scale the sums of sampled alignments to all the mapped reads
+        if self.alignment_scaling_factor != 1:
+            s = s*self.alignment_scaling_factor
         total_error = s["insertion"]+s["deletion"]+s["mismatch"]
         matching = s["align_len"]-total_error
         unmapped = bc_bases-s["read_len"]
@@ -1611,19 +1636,11 @@ class pycoQC_plot ():
             raise pycoQCError ("No Alignment information available")
         self.logger.info ("\t\tComputing plot")
 
-        ref_offset_dict = self._ref_offset(self.ref_len_dict, "left", ret_type="dict")
-        df = self.all_df[["ref_id", "ref_start", "ref_end", "align_len"]].dropna()
         steps = self.total_ref_len//nbins
-        mean_cov = round(df["align_len"].sum()/self.total_ref_len, 2)
+        mean_cov = round(self._alignment_mean_coverage("all"), 2)
 
         # Compute coverage by interval
-        l = []
-        for line in df.itertuples():
-            l.append(int(ref_offset_dict[line.ref_id]+line.ref_start))
-        l = np.array(l)
-        bins = np.arange(0, self.total_ref_len, steps)
-        l = np.digitize(l,bins)
-        y = np.bincount(l, weights=df["align_len"])/steps
+        y = self._compute_coverage_bins (steps)
 
         # Time series smoothing
         if smooth_sigma:
@@ -1631,7 +1648,7 @@ class pycoQC_plot ():
 
         # Plot coverage area
         data1 = go.Scatter (
-            x=list(range(nbins+1)),
+            x=list(range(len(y))),
             y=y,
             name="Mean coverage",
             hoveron="points",
@@ -1682,6 +1699,83 @@ class pycoQC_plot ():
 
         return go.Figure(data=[data1,data2], layout=layout)
 
+    def reference_coverage (self):
+        """
+        Return a DataFrame with the length, number of aligned reads, number of aligned bases and mean coverage of each reference
+        """
+        # Verify that alignemnt information are available
+        if not self.has_alignment:
+            raise pycoQCError ("No Alignment information available")
+
+        valid, ref_idx = self._aligned_ref_idx ()
+        align_len = self.all_df["align_len"].values[valid]
+        n_ref = len(self.ref_len_dict)
+        reads = np.bincount (ref_idx, minlength=n_ref)*self.alignment_scaling_factor
+        bases = np.bincount (ref_idx, weights=align_len, minlength=n_ref)*self.alignment_scaling_factor
+        ref_len = np.array (list(self.ref_len_dict.values()), dtype=np.int64)
+
+        df = pd.DataFrame (OrderedDict((
+            ("ref_len", ref_len),
+            ("aligned_reads", np.round(reads).astype(np.int64)),
+            ("aligned_bases", np.round(bases).astype(np.int64)),
+            ("mean_coverage", bases/ref_len))), index=pd.Index(list(self.ref_len_dict.keys()), name="ref_id"))
+        return df
+
+    def _aligned_ref_idx (self):
+        """
+        Return the mask of aligned reads in all_df and the index of their reference in ref_len_dict order. The index is
+        obtained by remapping the codes of the categorical ref_id column, without any per read lookup
+        """
+        ref_list = list(self.ref_len_dict.keys())
+        ref_id = self.all_df["ref_id"]
+        codes = ref_id.cat.codes.values
+        valid = (codes >= 0) & ~self.all_df["align_len"].isna().values
+        code_to_idx = np.array ([ref_list.index(ref) for ref in ref_id.cat.categories], dtype=np.int64)
+        return valid, code_to_idx[codes[valid]]
+
+    def _compute_coverage_bins (self, steps):
+        """
+        Return the mean coverage of consecutive genome bins of size steps, over all the references concatenated in ref_len_dict order.
+        The bases of each alignment are spread uniformly across all the bins spanned by the alignment. Partial start and end bins are
+        added directly and the fully covered bins in between are filled with a difference array and a cumulative sum
+        """
+        valid, ref_idx = self._aligned_ref_idx ()
+        ref_offset = np.array (self._ref_offset(self.ref_len_dict, "left", ret_type="list"), dtype=np.int64)
+        ref_len = np.array (list(self.ref_len_dict.values()), dtype=np.int64)
+        offset = ref_offset[ref_idx]
+        start = offset + self.all_df["ref_start"].values[valid]
+        end = offset + self.all_df["ref_end"].values[valid]
+        align_len = self.all_df["align_len"].values[valid].astype(np.float64)
+        has_span = end>start
+        rate = np.divide (align_len, end-start, out=np.zeros_like(align_len), where=has_span)
+
+        # Bases beyond the end of their reference are discarded
+        end = np.minimum (end, offset+ref_len[ref_idx])
+        start = np.minimum (start, end)
+        bases = np.where (has_span, rate*(end-start), align_len)
+
+        # Define bins and bin index of alignment boundaries. The last bin extends to the end of the last reference
+        n_bins = len(np.arange(0, self.total_ref_len, steps))
+        start_bin = np.minimum (start//steps, n_bins-1).astype(np.int64)
+        end_bin = np.minimum (end//steps, n_bins-1).astype(np.int64)
+
+        # Alignments contained in a single bin
+        single = start_bin == end_bin
+        y = np.bincount (start_bin[single], weights=bases[single], minlength=n_bins)
+
+        # Partial first and last bins of alignments spanning several bins
+        multi = ~single
+        start_bin, end_bin, start, end, rate = start_bin[multi], end_bin[multi], start[multi], end[multi], rate[multi]
+        y += np.bincount (start_bin, weights=rate*((start_bin+1)*steps-start), minlength=n_bins)
+        y += np.bincount (end_bin, weights=rate*(end-end_bin*steps), minlength=n_bins)
+
+        # Fully covered bins in between
+        diff = np.bincount (start_bin+1, weights=rate*steps, minlength=n_bins+1)
+        diff -= np.bincount (end_bin, weights=rate*steps, minlength=n_bins+1)
+        y += np.cumsum (diff)[:n_bins]
+
+        return y*self.alignment_scaling_factor/steps
+
     def _ref_offset (self, rlen, coordinates="left", ret_type="dict"):
         offset = [] if ret_type=="list" else OrderedDict()
         cumsum=0
@@ -1701,36 +1795,191 @@ class pycoQC_plot ():
             cumsum+=rlen
         return offset
 
-    #~~~~~~~PRIVATE METHODS~~~~~~~#
-    @staticmethod
-    def _compute_percentiles (data):
-        return list(np.quantile(data.dropna(), q=np.linspace(0,1,101)))
+    #~~~~~~~CACHE METHODS~~~~~~~#
+    def clear_cache (self):
+        """
+        Drop all the data derived from the reads (pass reads, sorted values, quantile sketches, time bins, metric cubes and
+        prepared plot data) and recompute the read counts. Must be called after changing min_pass_qual, min_pass_len or quantile_error
+        """
+        self.logger.debug ("\tReset cached data")
+
+        # The pass and barcode reads df, the sorted fields and the time bins are only extracted if required
+        self._pass_df = None
+        self._barcode_df_dict = {}
+        self._sorted_values_dict = {}
+        self._length_cumsum_dict = {}
+        self._time_bins_dict = {}
+        self._cube_dict = {}
+        self._data_cache = OrderedDict()
+        self._data_cache_stats = Counter()
+
+        # Reuse the quantile sketches filled by the parser if they were computed with the same options
+        self._sketch_dict = {}
+        fill_sketches = bool(self.quantile_error)
+        if self.quantile_error and self.parser.sketch_dict and (self.parser.quantile_error, self.parser.min_pass_qual, self.parser.min_pass_len) == (
+            self.quantile_error, self.min_pass_qual, self.min_pass_len):
+            self.logger.debug ("	Using quantile sketches from parser")
+            self._sketch_dict = dict (self.parser.sketch_dict)
+            fill_sketches = False
+
+        # Count the all and pass reads and fill the quantile sketches if needed in a single pass over the reads
+        self.all_count = self.pass_count = 0
+        for start in range (0, len(self.all_df), self.chunksize):
+            chunk_df = self.all_df.iloc[start:start+self.chunksize]
+            pass_chunk_df = chunk_df[self._pass_mask(chunk_df)]
+            self.all_count += len(chunk_df)
+            self.pass_count += len(pass_chunk_df)
+            if fill_sketches:
+                self._update_sketches (chunk_df, pass_chunk_df)
+        self.logger.info ("\tFound {:,} pass reads (qual >= {} and length >= {})".format(self.pass_count, self.min_pass_qual, self.min_pass_len))
+
+    def fill_cache (self, time_bins_list=[]):
+        """
+        Compute the data shared by several plotting and summary methods (pass reads, sorted values of the numeric fields and time bins
+        of all and pass reads), for example before forking processes which can then inherit them instead of computing them again
+        * time_bins_list
+            List of numbers of time bins for which the time bins are computed
+        """
+        self.logger.debug ("\tFill cached data")
+        for df_level in ("all", "pass"):
+            for field_name in ("read_len", "mean_qscore", "align_len", "identity_freq"):
+                if not field_name in self.all_df:
+                    continue
+                # Length values are always sorted for Nxx, the other fields only for exact quantiles
+                if field_name in ("read_len", "align_len"):
+                    self._compute_Nxx (df_level, field_name)
+                elif not self.quantile_error:
+                    self._sorted_values (df_level, field_name)
+            for time_bins in time_bins_list:
+                self._time_bins (df_level, time_bins)
+
+    def data_cache_info (self):
+        """
+        Return the number of hits and misses, the current size and the maximal size of the LRU cache of prepared plot data.
+        Plotting functions called again with different cosmetic arguments only (colors, width, height, title) are cache hits
+        """
+        return OrderedDict ((
+            ("hits", self._data_cache_stats["hits"]),
+            ("misses", self._data_cache_stats["misses"]),
+            ("size", len(self._data_cache)),
+            ("max_size", self.data_cache_size)))
 
-    @staticmethod
-    def _compute_N50 (data):
-        data = data.dropna().values
-        data.sort()
-        half_sum = data.sum()/2
-        cum_sum = 0
-        for v in data:
-            cum_sum += v
-            if cum_sum >= half_sum:
-                return int(v)
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+    def _time_bins (self, df_level, time_bins):
+        """
+        Return the edges of time_bins bins spanning the start time (in hours) of the reads of a level and the bin index of each read.
+        The bin assignment is cached per (df_level, time_bins) and shared by all the temporal plots
+        """
+        if not (df_level, time_bins) in self._time_bins_dict:
+            t = (self._get_df(df_level)["start_time"]/3600).values
+            bins = np.linspace (t.min(), t.max(), num=time_bins)
+            t_idx = np.digitize (t, bins=bins, right=True).astype (np.min_scalar_type(time_bins))
+            self._time_bins_dict[(df_level, time_bins)] = (bins, t_idx)
+        return self._time_bins_dict[(df_level, time_bins)]
+
+    def _metric_cube (self, time_bins=None):
+        """
+        Return the metric cube of all reads over (time_bin, channel, barcode, run_id, pass) cells, built in a single chunked pass and
+        cached per number of time bins. Counts of reads and bases per level, time bin, channel, barcode or run_id are answered by
+        reducing the cube instead of rescanning the reads. Barcode and run_id codes are shifted by 1, 0 standing for NA values.
+        Without time_bins, any cached cube is returned, else a cube with 500 time bins is built
+        """
+        if time_bins is None:
+            time_bins = next (iter(self._cube_dict), 500)
+        if not time_bins in self._cube_dict:
+            self.logger.debug ("\t\tBuilding metric cube with {} time bins".format(time_bins))
+            t_idx = self._time_bins ("all", time_bins)[1]
+            n_barcodes = len(self.all_df["barcode"].cat.categories) if self.has_barcodes else 0
+            shape = [time_bins+1, int(self.all_df["channel"].max())+1, n_barcodes+1, len(self.all_df["run_id"].cat.categories)+1, 2]
+            cube = MetricCube (dim_names=["time_bin", "channel", "barcode", "run_id", "pass"], shape=shape)
+            for start in range (0, len(self.all_df), self.chunksize):
+                chunk_df = self.all_df.iloc[start:start+self.chunksize]
+                dim_dict = {
+                    "time_bin": t_idx[start:start+self.chunksize],
+                    "channel": chunk_df["channel"].values,
+                    "barcode": chunk_df["barcode"].cat.codes.values+1 if self.has_barcodes else np.zeros(len(chunk_df), dtype=np.int8),
+                    "run_id": chunk_df["run_id"].cat.codes.values+1,
+                    "pass": self._pass_mask(chunk_df)}
+                cube.update (dim_dict, read_len=chunk_df["read_len"].values)
+            self._cube_dict[time_bins] = cube
+        return self._cube_dict[time_bins]
+
+    def _cube_filters (self, df_level):
+        """Return the metric cube filters selecting the reads of a level"""
+        if df_level == "all":
+            return {}
+        elif df_level == "pass":
+            return {"pass":1}
+        return {"barcode":self.all_df["barcode"].cat.categories.get_indexer([df_level])[0]+1}
+
+    def _update_sketches (self, chunk_df, pass_chunk_df):
+        """Update the quantile sketches of all numeric fields for all and pass levels with a chunk of reads"""
+        field_names = [field for field in ("read_len", "mean_qscore", "align_len", "identity_freq") if field in chunk_df]
+        for df_level, df in (("all", chunk_df), ("pass", pass_chunk_df)):
+            for field_name in field_names:
+                if not (df_level, field_name) in self._sketch_dict:
+                    self._sketch_dict[(df_level, field_name)] = QuantileSketch (eps=self.quantile_error, seed=SEED)
+                self._sketch_dict[(df_level, field_name)].update (df[field_name].values)
+
+    def _sorted_values (self, df_level, field_name):
+        """Return the values of a field sorted in ascending order without NA values. The sorted array is cached per level"""
+        if not (df_level, field_name) in self._sorted_values_dict:
+            self._sorted_values_dict[(df_level, field_name)] = np.sort (self._get_df(df_level)[field_name].dropna().values)
+        return self._sorted_values_dict[(df_level, field_name)]
+
+    def _compute_quantiles (self, df_level, field_name, q):
+        """Return the quantiles q of a field from the quantile sketches of all and pass reads, or exactly from the cached sorted values"""
+        if self.quantile_error and (df_level, field_name) in self._sketch_dict:
+            return self._sketch_dict[(df_level, field_name)].quantile(q)
+        return np.quantile (self._sorted_values(df_level, field_name), q)
+
+    def _paired_quantiles (self, df_level, field_names, q):
+        """Return the list of quantiles q of several fields, for the reads without NA values in any of the fields"""
+        if self.quantile_error:
+            sketch_list = [QuantileSketch (eps=self.quantile_error, seed=SEED) for field_name in field_names]
+            for df in self._iter_df_chunks (df_level, field_names):
+                df = df.dropna()
+                for sketch, field_name in zip (sketch_list, field_names):
+                    sketch.update (df[field_name].values)
+            return [sketch.quantile(q) for sketch in sketch_list]
+        df = self._get_df(df_level)[field_names].dropna()
+        return [np.quantile (df[field_name].values, q) for field_name in field_names]
+
+    def _compute_percentiles (self, df_level, field_name):
+        return list(self._compute_quantiles(df_level, field_name, q=np.linspace(0,1,101)))
+
+    def _compute_Nxx (self, df_level, field_name, xx=50):
+        """
+        Return the Nxx and Lxx values of a length field for one or several xx percentages, as a tuple of ints or of int arrays.
+        Nxx is the length of the read at which xx% of the bases are reached when reads are taken from the longest
+        to the shortest and Lxx is the number of reads required to reach it. The descending order is a reversed view of
+        the cached sorted values and its cumulative sum is cached per level, so all Nxx values cost one searchsorted
+        """
+        if not (df_level, field_name) in self._length_cumsum_dict:
+            self._length_cumsum_dict[(df_level, field_name)] = np.cumsum (self._sorted_values(df_level, field_name)[::-1], dtype=np.float64)
+        desc_values = self._sorted_values(df_level, field_name)[::-1]
+        cumsum = self._length_cumsum_dict[(df_level, field_name)]
+        if not len(cumsum):
+            return (None, 0) if np.isscalar(xx) else (np.full(len(xx), np.nan), np.zeros(len(xx), dtype=np.int64))
+
+        idx = np.searchsorted (cumsum, cumsum[-1]*np.asarray(xx, dtype=np.float64)/100, side="left")
+        idx = np.minimum (idx, len(cumsum)-1)
+        N = desc_values[idx].astype(np.int64)
+        L = idx+1
+        if np.isscalar(xx):
+            return (int(N), int(L))
+        return (N, L)
 
     @staticmethod
     def _compute_hist (data, x_scale="linear", smooth_sigma=2, nbins=200):
 
         # Count each categories in log or linear space
-        min = np.nanmin(data)
-        max = np.nanmax(data)
-
-        if x_scale == "log":
-            count_y, bins = np.histogram (a=data, bins=np.logspace (np.log10(min), np.log10(max)+0.1, nbins))
-        elif x_scale == "linear":
-            count_y, bins = np.histogram (a=data, bins= np.linspace (min, max, nbins))
+        hist = Hist1D.from_range (np.nanmin(data), np.nanmax(data), nbins, scale=x_scale)
+        hist.update (data)
+        count_y = hist.counts
 
         # Remove last bin from labels
-        count_x = bins[1:]
+        count_x = hist.bins[1:]
 
         # Smooth results with a gaussian filter
         if smooth_sigma:
@@ -7,10 +7,21 @@ import json
 from pkg_resources import resource_filename
 import datetime
 import os
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+import base64
+import uuid
+import warnings
 
 # Third party imports
+import numpy as np
+import pandas as pd
 import plotly.offline as py
 import jinja2
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Local imports
 from pycoQC.common import *
@@ -59,8 +70,31 @@ class pycoQC_report ():
         outfile:str,
         config_file:str="",
         template_file:str="",
-        report_title:str="PycoQC report"):
-        """"""
+        report_title:str="PycoQC report",
+        threads:int=1,
+        fast_json:bool=False,
+        binary_arrays:bool=False,
+        max_points:int=None,
+        float_precision:int=None,
+        trim_2d:bool=False,
+        max_size:float=None):
+        """
+        * fast_json
+            Serialise the figures with pycoQC NumPy aware JSON writer (using orjson if installed) instead of plotly default encoder
+        * binary_arrays
+            With fast_json, encode large numeric arrays as base64 typed arrays decoded in the browser by a small javascript function
+            embedded in the report, which makes reports smaller. The plotly.js version bundled with the report cannot decode them natively
+        * max_points
+            Decimate the 1D traces with more points to about max_points evenly spaced points
+        * float_precision
+            Round the float values of the traces to this number of significant digits. With binary_arrays, arrays are also encoded
+            as 32 bits floats if the precision is 7 digits or less
+        * trim_2d
+            Remove the empty rows and columns at the edges of the 2D density and channel activity matrices
+        * max_size
+            Payload budget of the report plots in MB. If the plots are larger, the reductions of PAYLOAD_REDUCTION_LEVELS are applied
+            in turn on top of max_points, float_precision and trim_2d, until the plots fit in the budget or all levels were tried
+        """
         self.logger.info("Generating HTML report")
 
         # Parse configuration file
@@ -69,38 +103,42 @@ class pycoQC_report ():
         self.logger.debug(config_dict)
 
         # Loop over configuration file and run the pycoQC functions defined
+        method_list = list(config_dict.items ())
+        div_kwargs = {"fast_json":fast_json, "binary_arrays":binary_arrays, "max_points":max_points,
+            "float_precision":float_precision, "trim_2d":trim_2d}
+        result_list = self._make_plots (method_list, threads, div_kwargs)
+
+        # Apply stronger payload reductions until the plots fit in the budget
+        if max_size:
+            for level_dict in PAYLOAD_REDUCTION_LEVELS:
+                plots_size = sum (len(plot) for plot, _, _ in result_list if plot)
+                if plots_size <= max_size*1024*1024:
+                    break
+                level_kwargs = payload_reduction_kwargs (div_kwargs, level_dict)
+                if level_kwargs == div_kwargs:
+                    continue
+                self.logger.info("\tPlots size {:.1f} KB above the {} MB budget. Reducing payload with {}".format(
+                    plots_size/1024, max_size, ", ".join("{}={}".format(k, level_kwargs[k]) for k in level_dict)))
+                div_kwargs = level_kwargs
+                result_list = self._make_plots (method_list, threads, div_kwargs)
+            else:
+                plots_size = sum (len(plot) for plot, _, _ in result_list if plot)
+                if plots_size > max_size*1024*1024:
+                    self.logger.warning("\tPlots size {:.1f} KB still above the {} MB budget after all reductions".format(plots_size/1024, max_size))
+
+        # Collect plots and messages in configuration file order
         plots = list()
         titles = list()
-        for method_name, method_args in config_dict.items ():
-            try:
-                self.logger.info("\tRunning method {}".format(method_name))
-                self.logger.debug ("\t{} ({})".format(method_name, method_args))
-
-                # Store plot title for HTML title and remove from data passed to plotly
-                plot_title = method_args["plot_title"]
-                method_args["plot_title"]=""
-
-                # Get method and generate plot
-                method = getattr(self.plotter, method_name)
-                fig = method(**method_args)
-                plot = py.plot(
-                    fig,
-                    output_type='div',
-                    include_plotlyjs=False,
-                    image_width='',
-                    image_height='',
-                    show_link=False,
-                    auto_open=False)
-
+        for (method_name, method_args), (plot, plot_title, msg_list) in zip (method_list, result_list):
+            self.logger.info("\tRunning method {}".format(method_name))
+            self.logger.debug ("\t{} ({})".format(method_name, method_args))
+            for msg in msg_list:
+                self.logger.info("\t\t{}".format(msg))
+            if plot:
+                self.logger.info("\t\tHTML div size: {:.1f} KB".format(len(plot)/1024))
                 plots.append(plot)
                 titles.append(plot_title)
-
-            except AttributeError as E:
-                self.logger.info("\t\t{}".format("{} is not a valid plotting method".format(method_name)))
-                self.logger.info("\t\t{}".format(E))
-
-            except pycoQCError as E:
-                self.logger.info("\t\t{}".format(E))
+        self.logger.info("\tTotal plots size: {:.1f} KB".format(sum(len(plot) for plot in plots)/1024))
 
         # Load HTML template for Jinja
         self.logger.info("\tLoading HTML template")
@@ -153,6 +191,41 @@ class pycoQC_report ():
 
     #~~~~~~~~~~~~~~PRIVATE FUNCTION~~~~~~~~~~~~~~#
 
+    def _make_plots(self, method_list, threads, div_kwargs):
+        """Generate the plot divs of method_list in configuration file order, in parallel if several threads are given"""
+        if threads > 1 and len(method_list) > 1:
+            return self._make_plots_parallel (method_list, threads, div_kwargs)
+        return [make_plot_div (self.plotter, method_name, method_args, **div_kwargs) for method_name, method_args in method_list]
+
+    def _make_plots_parallel(self, method_list, threads, div_kwargs):
+        """
+        Generate the plot divs in a pool of worker processes forked after the plotter is set as a module global, so that the reads
+        data are shared copy-on-write instead of being pickled for each task. Threads are used where fork is not available.
+        Results are returned in the same order as method_list
+        """
+        global _worker_plotter
+
+        # Compute the data shared by several plots once in the parent so that all workers inherit them
+        time_bins_list = set()
+        for method_name, method_args in method_list:
+            method = getattr (self.plotter, method_name, None)
+            if method and "time_bins" in inspect.signature(method).parameters:
+                time_bins_list.add (method_args.get("time_bins", inspect.signature(method).parameters["time_bins"].default))
+        self.plotter.fill_cache (time_bins_list=sorted(time_bins_list))
+
+        if "fork" in mp.get_all_start_methods():
+            self.logger.info("\tGenerating plots in {} processes".format(threads))
+            _worker_plotter = self.plotter
+            try:
+                with mp.get_context("fork").Pool (threads) as pool:
+                    return pool.starmap (partial(make_plot_div_worker, **div_kwargs), method_list, chunksize=1)
+            finally:
+                _worker_plotter = None
+        else:
+            self.logger.info("\tGenerating plots in {} threads".format(threads))
+            with ThreadPool (threads) as pool:
+                return pool.starmap (partial(make_plot_div, self.plotter, **div_kwargs), method_list, chunksize=1)
+
     def _get_config(self, config_file=None):
         """"""
         # First, try to read provided configuration file if given
@@ -189,3 +262,255 @@ class pycoQC_report ():
             autoescape=jinja2.select_autoescape(["html"]))
         template = env.get_template('spectre.html.j2')
         return template
+
+#~~~~~~~~~~~~~~FUNCTIONS~~~~~~~~~~~~~~#
+
+# Plotter inherited by the forked plot worker processes
+_worker_plotter = None
+
+def make_plot_div (plotter, method_name, method_args, fast_json=False, binary_arrays=False, max_points=None, float_precision=None,
+    trim_2d=False):
+    """
+    Run a plotting method of the plotter and convert the figure to a HTML div. Return the div (None if the plot failed), the plot
+    title and the list of error messages
+    """
+    # Store plot title for HTML title and remove from data passed to plotly
+    method_args = dict(method_args)
+    plot_title = method_args.get("plot_title", "")
+    method_args["plot_title"]=""
+
+    try:
+        # Get method and generate plot
+        method = getattr(plotter, method_name)
+        fig = method(**method_args)
+        if fast_json:
+            plot = fig_to_div (fig, binary_arrays=binary_arrays, max_points=max_points, float_precision=float_precision, trim_2d=trim_2d)
+        else:
+            if max_points or float_precision or trim_2d:
+                fig = reduce_payload (fig.to_plotly_json(), max_points=max_points, float_precision=float_precision, trim_2d=trim_2d)
+            plot = py.plot(
+                fig,
+                output_type='div',
+                include_plotlyjs=False,
+                image_width='',
+                image_height='',
+                show_link=False,
+                auto_open=False)
+        return (plot, plot_title, [])
+
+    except AttributeError as E:
+        return (None, plot_title, ["{} is not a valid plotting method".format(method_name), str(E)])
+
+    except pycoQCError as E:
+        return (None, plot_title, [str(E)])
+
+def make_plot_div_worker (method_name, method_args, **kwargs):
+    """Worker function running make_plot_div with the plotter inherited from the parent process"""
+    return make_plot_div (_worker_plotter, method_name, method_args, **kwargs)
+
+# Minimal number of values of a numeric array to be encoded as a base64 typed array
+BINARY_MIN_SIZE = 64
+
+# Typed array codes of the little endian numpy types supported by the browser decoder. 64 bits integers are converted to float64
+TYPED_ARRAY_CODES = OrderedDict ((
+    ("int8","i1"), ("uint8","u1"), ("int16","i2"), ("uint16","u2"), ("int32","i4"), ("uint32","u4"), ("float32","f4"), ("float64","f8")))
+
+# Javascript decoder replacing {dtype, bdata, shape} objects by typed arrays (rows of typed arrays for 2D arrays) before plotting
+DECODE_ARRAYS_JS = """\
+window.pycoQC_decode=window.pycoQC_decode||function(o){\
+var T={i1:Int8Array,u1:Uint8Array,i2:Int16Array,u2:Uint16Array,i4:Int32Array,u4:Uint32Array,f4:Float32Array,f8:Float64Array};\
+function d(o){var i,k;if(Array.isArray(o)){for(i=0;i<o.length;i++)o[i]=d(o[i]);return o;}\
+if(o===null||typeof o!=="object")return o;\
+if(typeof o.bdata==="string"&&T.hasOwnProperty(o.dtype)){var b=atob(o.bdata),u=new Uint8Array(b.length);\
+for(i=0;i<b.length;i++)u[i]=b.charCodeAt(i);var a=new T[o.dtype](u.buffer),s=o.shape?String(o.shape).split(","):[];\
+if(s.length<2)return a;var n=Number(s[1]),r=[];for(i=0;i<Number(s[0]);i++)r.push(a.subarray(i*n,(i+1)*n));return r;}\
+for(k in o)if(o.hasOwnProperty(k))o[k]=d(o[k]);return o;}return d(o);};"""
+
+# Payload reductions applied in turn by html_report until the plots fit in max_size. A level never weakens the user settings
+PAYLOAD_REDUCTION_LEVELS = [
+    {"trim_2d":True},
+    {"trim_2d":True, "float_precision":4},
+    {"trim_2d":True, "float_precision":4, "max_points":1000},
+    {"trim_2d":True, "float_precision":3, "max_points":250}]
+
+def payload_reduction_kwargs (div_kwargs, level_dict):
+    """Return a copy of the make_plot_div kwargs with the reductions of level_dict, keeping the stronger of the 2 for each option"""
+    div_kwargs = dict (div_kwargs)
+    for key, val in level_dict.items():
+        if key == "trim_2d":
+            div_kwargs[key] = div_kwargs.get(key) or val
+        else:
+            div_kwargs[key] = min (div_kwargs[key], val) if div_kwargs.get(key) else val
+    return div_kwargs
+
+# Per point arrays of the traces decimated together with x and y
+POINT_ARRAY_KEYS = ("x", "y", "text", "hovertext", "customdata")
+
+def reduce_payload (fig_dict, max_points=None, float_precision=None, trim_2d=False):
+    """
+    Reduce in place the size of the trace arrays of a figure dict, including the traces data swapped by the restyle and update
+    buttons of the updatemenus
+    * max_points
+        If given, 1D traces with more points are decimated to about max_points evenly spaced points, keeping the first and last ones
+    * float_precision
+        If given, float arrays are rounded to this number of significant digits
+    * trim_2d
+        If True, the leading and trailing rows and columns of 2D matrices only containing NaN or the matrix minimal value are removed,
+        except the ones bordering the non empty region
+    """
+    for trace in fig_dict.get ("data", []):
+        reduce_trace (trace, max_points, float_precision, trim_2d)
+
+    for menu in fig_dict.get ("layout", {}).get ("updatemenus", []):
+        for button in menu.get ("buttons", []):
+            args = button.get ("args")
+            if button.get ("method") not in ("restyle", "update") or not args or not isinstance (args[0], dict):
+                continue
+            # Restyle values are lists with one item per trace
+            restyle_dict = {k:v for k, v in args[0].items() if isinstance (v, list)}
+            for i in range (max ([len(v) for v in restyle_dict.values()], default=0)):
+                trace = {k:v[i] for k, v in restyle_dict.items() if i < len(v)}
+                reduce_trace (trace, max_points, float_precision, trim_2d)
+                for k, v in trace.items():
+                    restyle_dict[k][i] = v
+    return fig_dict
+
+def reduce_trace (trace, max_points=None, float_precision=None, trim_2d=False):
+    """Reduce in place the size of the arrays of a single trace dict. See reduce_payload"""
+    z = trace.get ("z")
+    if trim_2d and isinstance (z, np.ndarray) and z.ndim == 2 and z.size:
+        _trim_2d_trace (trace)
+
+    x, y = trace.get ("x"), trace.get ("y")
+    if max_points and z is None and _is_1d_array (x) and _is_1d_array (y) and len(x) == len(y) and len(x) > max_points:
+        n = len(x)
+        idx = np.unique (np.linspace (0, n-1, max_points).round().astype(np.int64))
+        for key in POINT_ARRAY_KEYS:
+            val = trace.get (key)
+            if _is_1d_array (val) and len(val) == n:
+                trace[key] = np.asarray(val)[idx]
+
+    if float_precision:
+        for key, val in trace.items():
+            if isinstance (val, np.ndarray) and val.dtype.kind == "f":
+                trace[key] = round_significant (val, float_precision)
+    return trace
+
+def _trim_2d_trace (trace):
+    """
+    Remove the empty leading and trailing rows and columns of the z matrix of a heatmap or contour trace, and the corresponding
+    x and y coordinates, given either as bin centers or bin edges. An axis is only trimmed if its coordinates are given.
+    One empty row or column is kept on each side so that the color scale floor and the contours closure are unchanged
+    """
+    z = trace["z"]
+    with warnings.catch_warnings():
+        warnings.simplefilter ("ignore", category=RuntimeWarning)
+        empty = np.isnan(z) | (z <= np.nanmin(z)) if z.dtype.kind == "f" else z <= z.min()
+    if empty.all():
+        return
+
+    for axis, key in ((0, "y"), (1, "x")):
+        coord = trace.get (key)
+        if not _is_1d_array (coord):
+            continue
+        full = np.flatnonzero (~empty.all (axis=1-axis))
+        n = z.shape[axis]
+        start, end = max (full[0]-1, 0), min (full[-1]+2, n)
+        if (start, end) == (0, n):
+            continue
+        # Coordinates are either bin centers or bin edges
+        if len(coord) == n:
+            trace[key] = np.asarray(coord)[start:end]
+        elif len(coord) == n+1:
+            trace[key] = np.asarray(coord)[start:end+1]
+        else:
+            continue
+        z = z[start:end] if axis == 0 else z[:, start:end]
+        empty = empty[start:end] if axis == 0 else empty[:, start:end]
+    trace["z"] = z
+
+def _is_1d_array (val):
+    """True for lists, tuples and 1D numpy arrays"""
+    return isinstance (val, (list, tuple)) or (isinstance (val, np.ndarray) and val.ndim == 1)
+
+def round_significant (a, digits):
+    """Round a float array to a number of significant digits. Non finite values are kept"""
+    with np.errstate (divide="ignore", invalid="ignore"):
+        magnitude = np.floor (np.log10 (np.abs (a)))
+    magnitude[~np.isfinite(magnitude)] = 0
+    scale = 10.0 ** (digits - 1 - magnitude)
+    return np.round (a * scale) / scale
+
+def encode_arrays (obj, binary_arrays=False, float32=False):
+    """
+    Recursively convert a figure dict to objects that dumps_json can serialise. Numpy arrays of at least BINARY_MIN_SIZE numeric
+    values are encoded as {dtype, bdata, shape} base64 typed arrays if binary_arrays, using 32 bits floats if float32. Other numeric
+    arrays are directly written by orjson if available, or converted to lists. Non finite floats are converted to None, as in
+    plotly encoder
+    """
+    if isinstance (obj, dict):
+        return {k:encode_arrays(v, binary_arrays, float32) for k, v in obj.items()}
+    if isinstance (obj, (list, tuple)):
+        return [encode_arrays(v, binary_arrays, float32) for v in obj]
+    if isinstance (obj, (pd.Index, pd.Series)):
+        obj = obj.values
+    if isinstance (obj, np.ndarray):
+        if obj.dtype.kind in "iuf" and obj.ndim in (1, 2):
+            if obj.dtype.kind in "iu" and obj.dtype.itemsize == 8:
+                obj = obj.astype (np.float64)
+            if binary_arrays and obj.size >= BINARY_MIN_SIZE:
+                if float32 and obj.dtype == np.float64:
+                    obj = obj.astype (np.float32)
+                obj = np.ascontiguousarray (obj, dtype=obj.dtype.newbyteorder("<"))
+                d = {"dtype":TYPED_ARRAY_CODES[obj.dtype.name], "bdata":base64.b64encode(obj.tobytes()).decode("ascii")}
+                if obj.ndim == 2:
+                    d["shape"] = "{}, {}".format(*obj.shape)
+                return d
+            # orjson writes non finite values as null
+            if orjson:
+                return np.ascontiguousarray (obj)
+            if obj.dtype.kind == "f":
+                obj = np.where (np.isfinite(obj), obj, None)
+            return obj.tolist()
+        return encode_arrays (obj.tolist(), binary_arrays, float32)
+    if isinstance (obj, np.generic):
+        obj = obj.item()
+    if isinstance (obj, float) and not np.isfinite(obj):
+        return None
+    return obj
+
+def dumps_json (obj):
+    """Serialise the output of encode_arrays to a compact JSON string, safe to embed in a script tag"""
+    if orjson:
+        s = orjson.dumps (obj, option=orjson.OPT_SERIALIZE_NUMPY).decode ("utf-8")
+    else:
+        s = json.dumps (obj, separators=(",", ":"))
+    return s.replace ("</", "<\\/")
+
+def fig_to_div (fig, binary_arrays=False, max_points=None, float_precision=None, trim_2d=False):
+    """
+    Convert a plotly figure to a HTML div similar to plotly.offline.plot output, with a faster NumPy aware serialisation.
+    Large numeric arrays can be embedded as base64 typed arrays decoded by a small javascript function defined in the div.
+    The traces arrays can also be reduced with reduce_payload before serialisation
+    """
+    fig_dict = fig.to_plotly_json ()
+    if max_points or float_precision or trim_2d:
+        reduce_payload (fig_dict, max_points=max_points, float_precision=float_precision, trim_2d=trim_2d)
+    float32 = bool(float_precision) and float_precision <= 7
+    layout_dict = fig_dict.get ("layout", {})
+    data = dumps_json (encode_arrays (fig_dict.get("data", []), binary_arrays, float32))
+    layout = dumps_json (encode_arrays (layout_dict, binary_arrays, float32))
+
+    # Define div size from the layout as in plotly
+    div_size = []
+    for key in ("height", "width"):
+        val = layout_dict.get(key)
+        div_size.append ("{}px".format(val) if val else "100%")
+
+    div_id = str(uuid.uuid4())
+    decode_js = DECODE_ARRAYS_JS if binary_arrays else "window.pycoQC_decode=window.pycoQC_decode||function(o){return o;};"
+    return (
+        '<div><div id="{id}" class="plotly-graph-div" style="height:{h}; width:{w};"></div>'
+        '<script type="text/javascript">{decode_js}window.PLOTLYENV=window.PLOTLYENV || {{}};'
+        'if (document.getElementById("{id}")) {{Plotly.newPlot("{id}", pycoQC_decode({data}), pycoQC_decode({layout}), {{"responsive": true}})}};'
+        '</script></div>').format(id=div_id, h=div_size[0], w=div_size[1], decode_js=decode_js, data=data, layout=layout)
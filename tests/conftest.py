@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import random
+from collections import *
+
+# Third party imports
+import pandas as pd
+import pysam as ps
+import pytest
+
+#~~~~~~~~~~~~~~FIXTURES~~~~~~~~~~~~~~#
+@pytest.fixture (scope="session")
+def synthetic_run (tmp_path_factory):
+    """
+    Write a synthetic sequencing summary file and a matching sorted and indexed BAM file. Mapped reads have primary, secondary and
+    supplementary alignments with soft clips, indels and either NM or MD tags. Return the paths of the 2 files
+    """
+    outdir = tmp_path_factory.mktemp ("synthetic_run")
+    summary_fn = str(outdir/"sequencing_summary.txt")
+    bam_fn = str(outdir/"aligned.bam")
+    unsorted_fn = str(outdir/"unsorted.bam")
+    rng = random.Random (42)
+    n_reads = 6000
+
+    # Summary file
+    d = OrderedDict ()
+    d["read_id"] = ["{:08x}-0000-4000-8000-{:012x}".format(i, rng.getrandbits(48)) for i in range(n_reads)]
+    d["run_id"] = "run1"
+    d["channel"] = [rng.randint(1, 512) for _ in range(n_reads)]
+    d["start_time"] = [round(rng.uniform(0, 3600), 3) for _ in range(n_reads)]
+    d["sequence_length_template"] = [rng.randint(200, 2000) for _ in range(n_reads)]
+    d["mean_qscore_template"] = [round(rng.uniform(4, 14), 2) for _ in range(n_reads)]
+    pd.DataFrame(d).to_csv (summary_fn, sep="\t", index=False)
+
+    # Alignments
+    header = {"HD":{"VN":"1.0", "SO":"coordinate"}, "SQ":[{"SN":"chr1", "LN":500000}, {"SN":"chr2", "LN":300000}, {"SN":"chrM", "LN":16000}]}
+    records = []
+    for read_id, read_len in zip (d["read_id"], d["sequence_length_template"]):
+        if rng.random() < 0.1:
+            records.append ((3, 0, read_id, read_len, 4))
+            continue
+        for flag in (0, 256, 2048):
+            if flag and rng.random() > 0.1:
+                continue
+            ref_id = rng.choice ([0, 0, 1, 2])
+            start = rng.randint (0, header["SQ"][ref_id]["LN"]-read_len-10)
+            records.append ((ref_id, start, read_id, read_len, flag))
+    records.sort (key=lambda r: (r[0], r[1]))
+
+    with ps.AlignmentFile (unsorted_fn, "wb", header=header) as bam:
+        for ref_id, start, read_id, read_len, flag in records:
+            a = ps.AlignedSegment (bam.header)
+            a.query_name = read_id
+            a.flag = flag
+            if flag == 4:
+                a.query_sequence = "A"*read_len
+            else:
+                insertion = rng.randint (0, 5)
+                deletion = rng.randint (0, 5)
+                match = read_len-5-insertion
+                a.reference_id = ref_id
+                a.reference_start = start
+                a.cigar = [(4, 5), (0, match//2), (1, insertion), (2, deletion), (0, match-match//2)]
+                a.query_sequence = "A"*read_len
+                a.mapping_quality = rng.randint (0, 60)
+                mismatch = rng.randint (0, 20)
+                if rng.random() < 0.5:
+                    a.set_tag ("NM", mismatch+insertion+deletion)
+                else:
+                    a.set_tag ("MD", "3A"*mismatch+"10^"+"A"*deletion+"10")
+            bam.write (a)
+    ps.sort ("-o", bam_fn, unsorted_fn)
+    ps.index (bam_fn)
+
+    return (summary_fn, bam_fn)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import uuid
+
+# Third party imports
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local imports
+from pycoQC.common import *
+from pycoQC.pycoQC_parse import pycoQC_parse
+
+#~~~~~~~~~~~~~~GLOBALS~~~~~~~~~~~~~~#
+DATA_DIR = path.join (path.dirname(path.dirname(path.abspath(__file__))), "docs", "pycoQC", "data")
+
+#~~~~~~~~~~~~~~TESTS~~~~~~~~~~~~~~#
+def test_npy_dir_round_trip (tmp_path):
+    df = pd.DataFrame (OrderedDict ((
+        ("channel", np.array([1, 2, 3], dtype=np.uint16)),
+        ("barcode", pd.Categorical(["bc01", "unclassified", "bc01"])),
+        ("comment", np.array(["é", np.nan, "x"], dtype=object)))),
+        index=pd.Index(["read_1", "read_22", "read_333"], name="read_id"))
+    df_to_npy_dir (df, str(tmp_path/"df"))
+
+    # ASCII strings are stored as fixed-width bytes, other object columns as codes and values
+    with open (str(tmp_path/"df"/"columns.json")) as fp:
+        kinds = [col["kind"] for col in json.load(fp)["columns"]]
+    assert kinds == ["bytes", "numeric", "category", "object"]
+    assert np.load (str(tmp_path/"df"/"col_0.npy"), mmap_mode="r").dtype == np.dtype("S8")
+
+    for mmap in (True, False):
+        pd.testing.assert_frame_equal (npy_dir_to_df (str(tmp_path/"df"), mmap=mmap), df)
+
+def test_npy_dir_round_trip_empty (tmp_path):
+    df_to_npy_dir (pd.DataFrame(), str(tmp_path/"empty"))
+    df = npy_dir_to_df (str(tmp_path/"empty"), mmap=False)
+    assert df.empty
+    assert len(df.columns) == 0
+
+def test_parse_cache_round_trip (tmp_path):
+    kwargs = dict (
+        summary_file = path.join(DATA_DIR, "Guppy-basecall-1D-DNA_sequencing_summary.txt.gz"),
+        barcode_file = path.join(DATA_DIR, "Guppy-basecall-1D-DNA_deepbinner_barcoding_summary.txt.gz"),
+        cache_dir = str(tmp_path/"cache"),
+        verbose = False,
+        quiet = True)
+    p1 = pycoQC_parse (**kwargs)
+    p2 = pycoQC_parse (**kwargs)
+    assert len(os.listdir(str(tmp_path/"cache"))) == 1
+
+    # Without BAM file the alignments_df is empty
+    assert p1.alignments_df.empty
+    assert p2.alignments_df.empty
+    pd.testing.assert_frame_equal (p1.reads_df, p2.reads_df)
+    assert p1.counter == p2.counter
+    assert p2.reads_df.index.name == "read_id"
+
+def test_metric_cube_reduce ():
+    rng = np.random.RandomState (0)
+    df = pd.DataFrame ({"time_bin":rng.randint(0, 10, 5000), "channel":rng.randint(1, 50, 5000), "pass":rng.randint(0, 2, 5000), "read_len":rng.randint(1, 10000, 5000)})
+
+    # Cubes aggregated per chunk and merged are the same as a cube aggregated in one go
+    cube = MetricCube (dim_names=["time_bin", "channel", "pass"], shape=[10, 50, 2])
+    for start in range (0, len(df), 777):
+        chunk_cube = MetricCube (dim_names=["time_bin", "channel", "pass"], shape=[10, 50, 2])
+        chunk_df = df.iloc[start:start+777]
+        chunk_cube.update (chunk_df, read_len=chunk_df["read_len"].values)
+        cube.merge (chunk_cube)
+
+    assert cube.reduce ([]) == {"reads":len(df), "bases":int(df["read_len"].sum())}
+    pass_df = df[df["pass"]==1]
+    assert cube.reduce ([], **{"pass":1}) == {"reads":len(pass_df), "bases":int(pass_df["read_len"].sum())}
+
+    # Reductions over dimensions match group counts of the reads
+    cells = cube.reduce (["time_bin", "channel"], **{"pass":1})
+    ref = pass_df.groupby (["time_bin", "channel"])["read_len"].agg(["count", "sum"])
+    assert np.array_equal (cells["time_bin"], ref.index.get_level_values(0))
+    assert np.array_equal (cells["channel"], ref.index.get_level_values(1))
+    assert np.array_equal (cells["reads"], ref["count"])
+    assert np.array_equal (cells["bases"], ref["sum"])
+
+def test_read_id_to_key ():
+    rng = np.random.RandomState (0)
+    uuids = [str(uuid.UUID(bytes=rng.bytes(16))) for _ in range(1000)]
+    others = ["read_{}".format(i) for i in range(500)] + [u.upper() for u in uuids[:10]] + [u.replace("-", "") for u in uuids[:10]]
+    read_ids = np.array (uuids+others+uuids[:50]+others[:50], dtype=object)
+    key_hi, key_lo = read_id_to_key (read_ids, block_size=128)
+
+    # UUIDs keys are their 128 bits integer value
+    ref = [uuid.UUID(u).int for u in uuids]
+    assert [int(i) for i in key_hi[:1000]] == [i >> 64 for i in ref]
+    assert [int(i) for i in key_lo[:1000]] == [i & (2**64-1) for i in ref]
+
+    # Keys are equal if and only if the read_ids are equal
+    ref_dup = pd.Series(read_ids).duplicated().values
+    assert np.array_equal (pd.DataFrame({"hi":key_hi, "lo":key_lo}).duplicated().values, ref_dup)
+
+    # Duplicates across chunks are flagged as by pandas duplicated on the whole array
+    read_key_set = ReadKeySet ()
+    first = np.concatenate ([read_key_set.first_mask (key_hi[i:i+333], key_lo[i:i+333]) for i in range (0, len(read_ids), 333)])
+    assert np.array_equal (first, ~ref_dup)
+    assert len(read_key_set) == len(read_ids)
+
+@pytest.mark.parametrize ("eps", [0.01, 0.05])
+def test_quantile_sketch (eps):
+    rng = np.random.RandomState (1)
+    values = np.concatenate ([rng.lognormal (7, 1, 150000), np.full (20000, 1000.0)])
+    rng.shuffle (values)
+    q = np.linspace (0, 1, 101)
+
+    # Sketches of chunks merged together
+    sketch = QuantileSketch (eps=eps)
+    for chunk in np.array_split (values, 17):
+        chunk_sketch = QuantileSketch (eps=eps)
+        chunk_sketch.update (chunk)
+        sketch.merge (chunk_sketch)
+    assert len(sketch) == len(values)
+    assert sketch.k*10 > sum(len(c) for c in sketch.compactors)
+
+    # Rank error against the exact quantiles, with exact min and max
+    est = sketch.quantile (q)
+    sorted_values = np.sort (values)
+    rank_lo = np.searchsorted (sorted_values, est, side="left")/len(values)
+    rank_hi = np.searchsorted (sorted_values, est, side="right")/len(values)
+    assert (np.maximum (rank_lo-q, q-rank_hi) < 2*eps).all()
+    assert est[0] == values.min()
+    assert est[-1] == values.max()
+
+def test_parse_cache_key_and_eviction (tmp_path, synthetic_run):
+    summary_fn, bam_fn = synthetic_run
+    cache_dir = str(tmp_path/"cache")
+    kwargs = dict (summary_file=summary_fn, bam_file=bam_fn, cache_dir=cache_dir, verbose=False, quiet=True)
+
+    # Parsed data with alignments are identical after a round trip in the cache
+    ref = pycoQC_parse (summary_file=summary_fn, bam_file=bam_fn, verbose=False, quiet=True)
+    p1 = pycoQC_parse (**kwargs)
+    p2 = pycoQC_parse (**kwargs)
+    for p in (p1, p2):
+        pd.testing.assert_frame_equal (p.reads_df, ref.reads_df)
+        pd.testing.assert_frame_equal (p.alignments_df, ref.alignments_df)
+        assert p.counter == ref.counter
+        assert list(p.ref_len_dict.items()) == list(ref.ref_len_dict.items())
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Options affecting the parsed data give a new entry, others reuse the cached one
+    assert p1._cache_key() == pycoQC_parse (threads=2, **kwargs)._cache_key()
+    p3 = pycoQC_parse (filter_duplicated=True, **kwargs)
+    assert p3._cache_key() != p1._cache_key()
+    assert len(os.listdir(cache_dir)) == 2
+
+    # Least recently used entries are removed first. The entry in use is always kept
+    os.utime (path.join(cache_dir, p3._cache_key()), (0, 0))
+    entry_size = dir_size (path.join(cache_dir, p1._cache_key()))
+    assert evict_lru_cache (cache_dir, max_size=entry_size*1.5) == [p3._cache_key()]
+    assert evict_lru_cache (cache_dir, max_size=0, keep=[p1._cache_key()]) == []
+    assert os.listdir(cache_dir) == [p1._cache_key()]
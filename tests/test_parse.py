@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Third party imports
+import numpy as np
+import pandas as pd
+import pysam as ps
+import pytest
+
+# Local imports
+from pycoQC.common import *
+from pycoQC.pycoQC_parse import *
+
+#~~~~~~~~~~~~~~HELPERS~~~~~~~~~~~~~~#
+def write_summary (fn, n, run_id, barcode=False, calibration=False, seed=0):
+    """Write a small synthetic sequencing summary file with n reads and optional barcode and calibration columns"""
+    rng = np.random.RandomState (seed)
+    d = OrderedDict ()
+    d["read_id"] = ["{}-{:08d}-0000-0000-0000-000000000000".format(run_id, i) for i in range(n)]
+    d["run_id"] = run_id
+    d["channel"] = rng.randint (1, 512, n)
+    d["start_time"] = np.round (rng.uniform (0, 1000, n), 3)
+    d["sequence_length_template"] = rng.randint (1, 10000, n)
+    d["mean_qscore_template"] = np.round (rng.uniform (2, 15, n), 2)
+    if barcode:
+        d["barcode_arrangement"] = rng.choice (["barcode01", "barcode02", "unclassified"], n)
+    if calibration:
+        d["calibration_strand_genome_template"] = rng.choice (["filtered_out", "no_match", "*", "YHR174W"], n, p=[0.7, 0.1, 0.1, 0.1])
+    pd.DataFrame(d).to_csv (fn, sep="\t", index=False)
+    return str(fn)
+
+def baseline_read_stats (read):
+    """Alignment statistics of a single read computed as in pycoQC 2.5 with pysam accessors"""
+    d = OrderedDict()
+    d["ref_id"] = read.reference_name
+    d["ref_start"] = read.reference_start
+    d["ref_end"] = read.reference_end
+    d["align_len"] = read.query_alignment_length
+    d["mapq"] = read.mapping_quality
+    c_stat = read.get_cigar_stats()[0]
+    d["insertion"] = c_stat[1]
+    d["deletion"] = c_stat[2]
+    d["soft_clip"] = c_stat[4]
+    if read.has_tag("NM"):
+        edit_dist = read.get_tag("NM")
+        d["mismatch"] = edit_dist-(d["deletion"]+d["insertion"])
+    elif read.has_tag("MD"):
+        d["mismatch"] = sum(i in "ATCGatcg" for i in read.get_tag("MD"))-d["deletion"]
+        edit_dist = d["mismatch"]+d["insertion"]+d["deletion"]
+    d["identity_freq"] = (d["align_len"]-edit_dist)/d["align_len"] if d["align_len"] else 0
+    return d
+
+def baseline_parse_bam (bam_fn):
+    """Parse a BAM file read by read as in pycoQC 2.5. Return a df of primary alignments statistics in file order and the counts"""
+    alignments_dict = Counter()
+    read_dict = OrderedDict ()
+    with ps.AlignmentFile(bam_fn, "rb") as bam:
+        for read in bam:
+            if read.is_unmapped:
+                alignments_dict["Unmapped"]+=1
+            elif read.is_secondary:
+                alignments_dict["Secondary"]+=1
+            elif read.is_supplementary:
+                alignments_dict["Suplementary"]+=1
+            elif read.query_name in read_dict:
+                alignments_dict["Duplicated"]+=1
+            else:
+                alignments_dict["Primary"]+=1
+                read_dict[read.query_name] = baseline_read_stats(read)
+    return (pd.DataFrame.from_dict(read_dict, orient="index"), alignments_dict)
+
+def baseline_read_filters (df, filter_calibration=False, filter_duplicated=False, runid_list=[]):
+    """Filter the reads one stage after the other as in pycoQC 2.5. Return the filtered df and the counts of discarded reads"""
+    counter = Counter()
+    stage_list = [
+        ("Reads with NA values discarded", lambda df: df.dropna(subset=["read_id", "run_id", "channel", "start_time", "read_len", "mean_qscore"])),
+        ("Zero length reads discarded", lambda df: df[df["read_len"] > 0])]
+    if filter_duplicated:
+        stage_list.append (("Duplicated reads discarded", lambda df: df[~df.duplicated(subset="read_id", keep="first")]))
+    if filter_calibration:
+        stage_list.append (("Calibration reads discarded", lambda df: df[df["calibration"].isin(["filtered_out", "no_match", "*"])]))
+    if runid_list:
+        stage_list.append (("Excluded runid reads discarded", lambda df: df[df["run_id"].isin(runid_list)]))
+    for label, func in stage_list:
+        l = len(df)
+        df = func(df)
+        counter[label] = l-len(df)
+    return (df, counter)
+
+#~~~~~~~~~~~~~~TESTS~~~~~~~~~~~~~~#
+def test_concat_columns_to_df_union ():
+    col_dict_list = [
+        OrderedDict ((("a", np.arange(3, dtype=np.uint32)), ("b", pd.Categorical(["x", "y", "x"])))),
+        OrderedDict ((("a", np.arange(2, dtype=np.uint32)), ("c", np.array([1.5, 2.5], dtype=np.float32))))]
+    df = concat_columns_to_df (col_dict_list)
+    assert list(df.columns) == ["a", "b", "c"]
+    assert df["a"].dtype == np.uint32
+    assert df["b"].dtype.name == "category"
+    assert list(df["b"].cat.categories) == ["x", "y"]
+    assert df["b"].isna().tolist() == [False, False, False, True, True]
+    assert df["c"].dtype == np.float32
+    assert df["c"].isna().tolist() == [True, True, True, False, False]
+
+@pytest.mark.parametrize ("chunksize", [0, 7])
+def test_parse_mismatched_headers (tmp_path, chunksize):
+    fn_list = [
+        write_summary (tmp_path/"s1.txt", 50, "run1", barcode=True, seed=1),
+        write_summary (tmp_path/"s2.txt", 30, "run2", calibration=True, seed=2)]
+    p = pycoQC_parse (summary_file=fn_list, filter_calibration=True, min_barcode_percent=0, chunksize=chunksize, verbose=False, quiet=True)
+    df = p.reads_df
+
+    # Optional columns found in any of the files are kept
+    assert "barcode" in df
+    assert "calibration" in df
+
+    # Reads from the file without barcodes are unclassified and calibration reads of the second file are removed
+    run2 = df[df["run_id"]=="run2"]
+    assert (run2["barcode"]=="unclassified").all()
+    assert len(df[df["run_id"]=="run1"]) == 50
+    calib = pd.read_csv (fn_list[1], sep="\t")["calibration_strand_genome_template"]
+    assert len(run2) == int(calib.isin(["filtered_out", "no_match", "*"]).sum())
+
+@pytest.mark.parametrize ("chunksize", [1, 13, 1000])
+def test_streaming_same_as_default (tmp_path, chunksize):
+    # Duplicated reads spread over several chunks, some of them being calibration reads
+    fn = write_summary (tmp_path/"s.txt", 200, "run1", calibration=True, seed=3)
+    df = pd.read_csv (fn, sep="\t")
+    df = pd.concat ([df, df.sample(50, random_state=1), df.sample(30, random_state=2)]).sample(frac=1, random_state=3)
+    df.to_csv (fn, sep="\t", index=False)
+
+    kwargs = dict (summary_file=fn, filter_calibration=True, filter_duplicated=True, verbose=False, quiet=True)
+    p_default = pycoQC_parse (**kwargs)
+    p_streaming = pycoQC_parse (chunksize=chunksize, **kwargs)
+    pd.testing.assert_frame_equal (p_default.reads_df, p_streaming.reads_df)
+    assert p_default.counter == p_streaming.counter
+
+    # With compact read_ids, the same reads are retained in the same order and indexed by their keys
+    p_compact = pycoQC_parse (chunksize=chunksize, compact_read_id=True, **kwargs)
+    key_hi, key_lo = read_id_to_key (p_default.reads_df.index)
+    assert np.array_equal (p_compact.reads_df["read_key_hi"].values, key_hi)
+    assert np.array_equal (p_compact.reads_df["read_key_lo"].values, key_lo)
+    pd.testing.assert_frame_equal (
+        p_default.reads_df.reset_index(drop=True),
+        p_compact.reads_df.drop(columns=["read_key_hi", "read_key_lo"]))
+
+def test_apply_read_filters_same_as_baseline (tmp_path):
+    fn = write_summary (tmp_path/"s.txt", 300, "run1", calibration=True, seed=4)
+    df = pd.concat ([pd.read_csv (fn, sep="\t"), pd.read_csv (write_summary (tmp_path/"s2.txt", 100, "run2", calibration=True, seed=5), sep="\t")])
+    df.columns = ["read_id", "run_id", "channel", "start_time", "read_len", "mean_qscore", "calibration"]
+
+    # Add duplicated reads, some with NA values or zero length, so that the stages overlap
+    rng = np.random.RandomState (6)
+    df = pd.concat ([df, df.sample(60, random_state=7)]).sample(frac=1, random_state=8).reset_index(drop=True)
+    df.loc[rng.choice(len(df), 20, replace=False), "mean_qscore"] = np.nan
+    df.loc[rng.choice(len(df), 20, replace=False), "channel"] = np.nan
+    df.loc[rng.choice(len(df), 20, replace=False), "read_len"] = 0
+
+    kwargs = dict (filter_calibration=True, filter_duplicated=True, runid_list=["run1"])
+    p = pycoQC_parse (summary_file=fn, verbose=False, quiet=True, **kwargs)
+    filtered_df, counter = p._apply_read_filters (df, p._get_read_filters (df.columns))
+    ref_df, ref_counter = baseline_read_filters (df, **kwargs)
+    pd.testing.assert_frame_equal (filtered_df, ref_df)
+    assert counter == ref_counter
+    assert all (ref_counter.values())
+
+@pytest.mark.parametrize ("n_regions", [1, 7, 200])
+def test_parse_bam_regions_same_as_baseline (synthetic_run, n_regions):
+    summary_fn, bam_fn = synthetic_run
+    ref_df, ref_counter = baseline_parse_bam (bam_fn)
+
+    # Regions cover all the mapped alignments once, in file order, including the ones overlapping the regions boundaries
+    with ps.AlignmentFile(bam_fn, "rb") as bam:
+        region_list = get_bam_regions (bam, n_regions=n_regions)
+        ref_names = list(bam.references)
+    assert len(region_list) >= min(n_regions, len(ref_names))
+    alignments_dict, col_dict = parse_bam_regions (region_list, block_size=97)
+    assert alignments_dict["Secondary"] == ref_counter["Secondary"]
+    assert alignments_dict["Suplementary"] == ref_counter["Suplementary"]
+    assert len(col_dict["read_id"]) == ref_counter["Primary"]+ref_counter["Duplicated"]
+    first = ~duplicated_str_array (col_dict["read_id"])
+    assert list(col_dict["read_id"][first]) == list(ref_df.index)
+
+    # Vectorised CIGAR and MD statistics
+    assert col_dict["has_score"].all()
+    assert [ref_names[i] for i in col_dict["ref_id"][first]] == list(ref_df["ref_id"])
+    for field in ("ref_start", "ref_end", "align_len", "mapq", "insertion", "deletion", "soft_clip", "mismatch"):
+        assert np.array_equal (col_dict[field][first], ref_df[field].values), field
+    assert np.allclose (col_dict["identity_freq"][first], ref_df["identity_freq"].values)
+
+@pytest.mark.parametrize ("threads", [1, 3])
+def test_parse_bam_same_as_baseline (synthetic_run, threads):
+    summary_fn, bam_fn = synthetic_run
+    ref_df, ref_counter = baseline_parse_bam (bam_fn)
+    p = pycoQC_parse (summary_file=summary_fn, bam_file=bam_fn, threads=threads, verbose=False, quiet=True)
+
+    counts = p.alignments_df.set_index("Alignments")["Counts"]
+    assert counts.to_dict() == {k:v for k, v in ref_counter.items() if v}
+    df = p.reads_df.loc[ref_df.index, ref_df.columns]
+    df["ref_id"] = df["ref_id"].astype(str)
+    pd.testing.assert_frame_equal (df, ref_df, check_dtype=False, check_names=False, rtol=1e-6)
+    assert p.reads_df["ref_id"].drop(ref_df.index).isna().all()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Third party imports
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local imports
+from pycoQC.pycoQC_parse import pycoQC_parse
+from pycoQC.pycoQC_plot import pycoQC_plot
+
+#~~~~~~~~~~~~~~HELPERS~~~~~~~~~~~~~~#
+def alignment_rate_table (plotter):
+    """Return the alignment_rate table as a Series of base counts and a Series of aligned frequencies indexed by category"""
+    fig = plotter.alignment_rate ()
+    cells = fig.data[0].cells.values
+    return (pd.Series(cells[1], index=cells[0], dtype=float), pd.Series(cells[3], index=cells[0], dtype=float))
+
+#~~~~~~~~~~~~~~TESTS~~~~~~~~~~~~~~#
+def test_alignment_rate_sampled (synthetic_run):
+    summary_fn, bam_fn = synthetic_run
+    full = pycoQC_parse (summary_file=summary_fn, bam_file=bam_fn, verbose=False, quiet=True)
+    sampled = pycoQC_parse (summary_file=summary_fn, bam_file=bam_fn, bam_sample=1000, verbose=False, quiet=True)
+    assert sampled.bam_scaling_factor > 2
+
+    full_counts, full_freq = alignment_rate_table (pycoQC_plot (full, quiet=True))
+    sampled_counts, sampled_freq = alignment_rate_table (pycoQC_plot (sampled, quiet=True))
+
+    # Base counts of sampled alignments are scaled to all the mapped reads
+    assert sampled_counts["Basecalled"] == full_counts["Basecalled"]
+    assert sampled_counts["Unmapped reads"] == pytest.approx (full_counts["Unmapped reads"], abs=0.05*full_counts["Basecalled"])
+    for category in ("Mapped reads", "Aligned", "Matching", "Insertions", "Deletions", "Mismatches"):
+        assert sampled_counts[category] == pytest.approx (full_counts[category], rel=0.15), category
+    for category in ("Matching", "Insertions", "Deletions", "Mismatches"):
+        assert sampled_freq[category] == pytest.approx (full_freq[category], rel=0.15), category
+
+@pytest.mark.parametrize ("quantile_error", [None, 0.01])
+def test_2D_density_medians_paired (synthetic_run, quantile_error):
+    summary_fn, bam_fn = synthetic_run
+    parser = pycoQC_parse (summary_file=summary_fn, bam_file=bam_fn, quantile_error=quantile_error, verbose=False, quiet=True)
+    plotter = pycoQC_plot (parser, quantile_error=quantile_error, quiet=True)
+    fig = plotter.read_len_align_len_2D ()
+
+    # Unmapped reads have no aligned length, so the read length median is computed on the mapped reads only
+    df = parser.reads_df[["read_len", "align_len"]].dropna()
+    assert len(df) < len(parser.reads_df)
+    x_med, y_med = fig.data[1].x[0], fig.data[1].y[0]
+    if quantile_error:
+        rank = lambda v, x: np.searchsorted (np.sort(v), x)/len(v)
+        assert abs (rank(df["read_len"].values, x_med)-0.5) < 2*quantile_error
+        assert abs (rank(df["align_len"].values, y_med)-0.5) < 2*quantile_error
+    else:
+        assert x_med == np.median (df["read_len"].values)
+        assert y_med == np.median (df["align_len"].values)
+
+def test_parser_sketches (synthetic_run):
+    summary_fn, bam_fn = synthetic_run
+    parser = pycoQC_parse (summary_file=summary_fn, bam_file=bam_fn, quantile_error=0.01, chunksize=500, verbose=False, quiet=True)
+    assert set(parser.sketch_dict) == {(l, f) for l in ("all", "pass") for f in ("read_len", "mean_qscore", "align_len", "identity_freq")}
+
+    # The plotter reuses the parser sketches only if they were computed with the same options
+    plotter = pycoQC_plot (parser, quantile_error=0.01, quiet=True)
+    assert plotter._sketch_dict[("pass", "read_len")] is parser.sketch_dict[("pass", "read_len")]
+    plotter = pycoQC_plot (parser, quantile_error=0.01, min_pass_qual=10, quiet=True)
+    assert plotter._sketch_dict[("pass", "read_len")] is not parser.sketch_dict[("pass", "read_len")]
+    assert len(plotter._sketch_dict[("pass", "read_len")]) == plotter.pass_count
+
+def test_compute_coverage_bins (synthetic_run):
+    summary_fn, bam_fn = synthetic_run
+    parser = pycoQC_parse (summary_file=summary_fn, bam_file=bam_fn, verbose=False, quiet=True)
+    plotter = pycoQC_plot (parser, quiet=True)
+    steps = plotter.total_ref_len//97
+
+    # Reference spreading the aligned bases of each alignment uniformly over all its reference positions
+    df = parser.reads_df.dropna (subset=["ref_id"])
+    ref_offset = dict(zip (parser.ref_len_dict, np.cumsum([0]+list(parser.ref_len_dict.values()))))
+    n_bins = len(np.arange(0, plotter.total_ref_len, steps))
+    ref = np.zeros (n_bins)
+    for ref_id, start, end, align_len in zip (df["ref_id"], df["ref_start"], df["ref_end"], df["align_len"]):
+        pos = ref_offset[ref_id] + np.arange (int(start), min(int(end), parser.ref_len_dict[ref_id]))
+        np.add.at (ref, np.minimum(pos//steps, n_bins-1), align_len/(end-start))
+    ref /= steps
+
+    y = plotter._compute_coverage_bins (steps)
+    assert np.allclose (y, ref)
+
+    # All the aligned bases are counted, as in the per read start coverage of pycoQC 2.5
+    assert y.sum()*steps == pytest.approx (df["align_len"].sum())
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import base64
+import json
+
+# Third party imports
+import numpy as np
+import plotly.graph_objs as go
+from plotly.utils import PlotlyJSONEncoder
+import pytest
+
+# Local imports
+from pycoQC.pycoQC_parse import pycoQC_parse
+from pycoQC.pycoQC_plot import pycoQC_plot
+from pycoQC.pycoQC_report import *
+
+#~~~~~~~~~~~~~~HELPERS~~~~~~~~~~~~~~#
+def decode_arrays (obj):
+    """Python equivalent of the javascript decoder of the base64 typed arrays embedded by encode_arrays"""
+    if isinstance (obj, list):
+        return [decode_arrays(v) for v in obj]
+    if isinstance (obj, dict):
+        if "bdata" in obj:
+            dtype = {v:k for k, v in TYPED_ARRAY_CODES.items()}[obj["dtype"]]
+            a = np.frombuffer (base64.b64decode(obj["bdata"]), dtype=np.dtype(dtype).newbyteorder("<"))
+            if "shape" in obj:
+                a = a.reshape ([int(i) for i in obj["shape"].split(",")])
+            return [None if isinstance(v, float) and np.isnan(v) else v for v in a.tolist()] if a.ndim == 1 else \
+                [[None if np.isnan(v) else v for v in row] for row in a.tolist()]
+        return {k:decode_arrays(v) for k, v in obj.items()}
+    return obj
+
+def assert_json_equal (res, ref, path=""):
+    """Compare 2 JSON objects. Numbers are compared with the precision of 32 bits floats, which orjson writes with their shortest repr"""
+    if isinstance (ref, dict):
+        assert isinstance (res, dict) and set(res) == set(ref), path
+        for k in ref:
+            assert_json_equal (res[k], ref[k], "{}/{}".format(path, k))
+    elif isinstance (ref, list):
+        assert isinstance (res, list) and len(res) == len(ref), path
+        for i, (a, b) in enumerate (zip (res, ref)):
+            assert_json_equal (a, b, "{}/{}".format(path, i))
+    elif isinstance (ref, (int, float)) and not isinstance (ref, bool):
+        assert res == pytest.approx (ref, rel=1e-7), path
+    else:
+        assert res == ref, path
+
+@pytest.fixture (scope="module")
+def fig_list (synthetic_run):
+    summary_fn, bam_fn = synthetic_run
+    parser = pycoQC_parse (summary_file=summary_fn, bam_file=bam_fn, verbose=False, quiet=True)
+    plotter = pycoQC_plot (parser, verbose=False, quiet=True)
+    return [plotter.read_len_read_qual_2D(), plotter.channels_activity(), plotter.output_over_time(), plotter.alignment_coverage()]
+
+#~~~~~~~~~~~~~~TESTS~~~~~~~~~~~~~~#
+@pytest.mark.parametrize ("binary_arrays", [False, True])
+def test_encode_arrays_same_as_plotly (fig_list, binary_arrays):
+    for fig in fig_list:
+        fig_dict = fig.to_plotly_json ()
+        ref = json.loads (json.dumps (fig_dict, cls=PlotlyJSONEncoder))
+        res = json.loads (dumps_json (encode_arrays (fig_dict, binary_arrays=binary_arrays)))
+        assert_json_equal (decode_arrays (res), ref)
+
+def test_reduce_payload ():
+    x = np.arange (5000)
+    y = np.sin (x/100.0)*1000
+    z = np.zeros ((50, 40))
+    z[10:20, 5:30] = np.random.RandomState(0).uniform (1, 10, (10, 25))
+    fig_dict = {
+        "data": [
+            {"type":"scatter", "x":x, "y":y, "text":x.astype(str)},
+            {"type":"heatmap", "x":np.arange(40), "y":np.arange(51), "z":z}],
+        "layout": {"updatemenus": [{"buttons": [{"method":"restyle", "args":[{"x":[x], "y":[y]}]}]}]}}
+    reduce_payload (fig_dict, max_points=100, float_precision=3, trim_2d=True)
+
+    # Decimated traces keep evenly spaced points, including the first and last ones, with their text
+    for trace in (fig_dict["data"][0], {k:v[0] for k, v in fig_dict["layout"]["updatemenus"][0]["buttons"][0]["args"][0].items()}):
+        assert len(trace["x"]) <= 100
+        assert trace["x"][0] == 0 and trace["x"][-1] == 4999
+        assert np.array_equal (trace["y"], [float("{:.3g}".format(v)) for v in np.sin(trace["x"]/100.0)*1000])
+    assert list(fig_dict["data"][0]["text"]) == [str(i) for i in fig_dict["data"][0]["x"]]
+
+    # 2D matrices keep the non empty region with one empty row and column around it, and the matching bin centers and edges
+    heatmap = fig_dict["data"][1]
+    assert heatmap["z"].shape == (12, 27)
+    assert list(heatmap["x"]) == list(range(4, 31))
+    assert list(heatmap["y"]) == list(range(9, 22))
+    assert np.array_equal (heatmap["z"], [[float("{:.3g}".format(v)) if v else 0 for v in row] for row in z[9:21, 4:31]])
+
+def test_payload_reduction_kwargs ():
+    div_kwargs = {"fast_json":False, "binary_arrays":False, "max_points":100, "float_precision":None, "trim_2d":False}
+    level_kwargs = payload_reduction_kwargs (div_kwargs, PAYLOAD_REDUCTION_LEVELS[-1])
+    # User settings are never weakened
+    assert level_kwargs["max_points"] == 100
+    assert level_kwargs["float_precision"] == PAYLOAD_REDUCTION_LEVELS[-1]["float_precision"]
+    assert level_kwargs["trim_2d"]
+    assert div_kwargs["float_precision"] is None
+
+def test_html_report_max_size (synthetic_run, tmp_path):
+    summary_fn, bam_fn = synthetic_run
+    parser = pycoQC_parse (summary_file=summary_fn, verbose=False, quiet=True)
+    plotter = pycoQC_plot (parser, verbose=False, quiet=True)
+    reporter = pycoQC_report (parser, plotter, verbose=False, quiet=True)
+
+    size_dict = {}
+    for max_size in (None, 0.000001):
+        outfile = str(tmp_path/"report_{}.html".format(max_size))
+        reporter.html_report (outfile=outfile, max_size=max_size)
+        with open (outfile) as fp:
+            size_dict[max_size] = len(fp.read())
+
+    # With an unreachable budget, all the reductions are applied
+    assert size_dict[0.000001] < size_dict[None]